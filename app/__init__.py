@@ -1,3 +1,4 @@
+import click
 from flask import Flask
 from app.config import config_by_name
 from datetime import datetime
@@ -6,6 +7,27 @@ def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config_by_name[config_name])
 
+    # Structured logs and request metrics
+    from app.utils import logging_config, metrics
+    logging_config.init_app(app)
+    metrics.init_app(app)
+
+    # Faster JSON serialization (orjson when available) and compressed responses
+    from app.utils import compression
+    from app.utils.json_provider import FastJSONProvider
+    app.json = FastJSONProvider(app)
+    compression.init_app(app)
+
+    # Configure the pooled HTTP session used for upstream API calls
+    from app.api import governor, http_client
+    http_client.init_app(app)
+    governor.init_app(app)
+
+    # Cache tiers (memory size, persistent backend, coordinate grid) and the observation history
+    from app.utils import cache, history
+    cache.init_app(app)
+    history.init_app(app)
+
     # --- Custom Jinja2 Filter ---
     def format_datetime(date_string, format='%a, %b %d'):
         """Converts a date string to a datetime object and formats it."""
@@ -30,4 +52,27 @@ def create_app(config_name='default'):
         """Runs a test command."""
         print("Shamiran is running!")
 
+    @app.cli.command("prefetch")
+    @click.option('--once', is_flag=True, help='Run a single refresh cycle and exit.')
+    def prefetch_command(once):
+        """Keeps popular cities in the cache refreshed ahead of expiry."""
+        from app.services import prefetch_service
+        if once:
+            refreshed = prefetch_service.run_once()
+            print(f"Refreshed: {', '.join(refreshed) or 'nothing'}")
+        else:
+            prefetch_service.run_forever(app)
+
+    @app.cli.command("history-compact")
+    def history_compact_command():
+        """Seals, downsamples and expires the recorded observation history."""
+        from app.utils import history
+        stats = history.compact()
+        print(", ".join(f"{name}: {count}" for name, count in stats.items()))
+
+    # Start the in-process prefetch scheduler if enabled
+    if app.config.get('PREFETCH_ENABLED'):
+        from app.services import prefetch_service
+        prefetch_service.start(app)
+
     return app
\ No newline at end of file
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import threading
+import time
+import requests
+from app.config import Config
+from app.utils import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; every process keeps its own budget
+    fcntl = None
+
+# Priority classes, most important first. A call may only take a token while
+# enough of the bucket is left for the classes above it.
+USER = 0
+ENRICH = 1
+PREFETCH = 2
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """
+    Raised instead of calling the upstream when the call budget is spent or
+    the endpoint's circuit breaker is open. It's a RequestException, so callers
+    that already handle network errors degrade the same way.
+    """
+    def __init__(self, endpoint, reason):
+        super().__init__(f"{endpoint}: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+
+# Settings used until init_app() is called with the Flask config.
+_settings = {
+    'calls_per_minute': Config.OWM_CALLS_PER_MINUTE,
+    'calls_per_day': Config.OWM_CALLS_PER_DAY,
+    'budget_file': Config.OWM_BUDGET_FILE,
+    'max_wait': Config.OWM_BUDGET_MAX_WAIT,
+    'reserve': {ENRICH: Config.OWM_ENRICH_RESERVE, PREFETCH: Config.OWM_PREFETCH_RESERVE},
+    'failure_threshold': Config.BREAKER_FAILURE_THRESHOLD,
+    'reset_timeout': Config.BREAKER_RESET_TIMEOUT,
+}
+
+def init_app(app):
+    """Reads the call budget and circuit breaker settings from the app config."""
+    _settings.update({
+        'calls_per_minute': app.config.get('OWM_CALLS_PER_MINUTE', _settings['calls_per_minute']),
+        'calls_per_day': app.config.get('OWM_CALLS_PER_DAY', _settings['calls_per_day']),
+        'budget_file': app.config.get('OWM_BUDGET_FILE', _settings['budget_file']),
+        'max_wait': app.config.get('OWM_BUDGET_MAX_WAIT', _settings['max_wait']),
+        'reserve': {
+            ENRICH: app.config.get('OWM_ENRICH_RESERVE', _settings['reserve'][ENRICH]),
+            PREFETCH: app.config.get('OWM_PREFETCH_RESERVE', _settings['reserve'][PREFETCH]),
+        },
+        'failure_threshold': app.config.get('BREAKER_FAILURE_THRESHOLD', _settings['failure_threshold']),
+        'reset_timeout': app.config.get('BREAKER_RESET_TIMEOUT', _settings['reset_timeout']),
+    })
+    _bucket.reset()
+    with _breakers_lock:
+        _breakers.clear()
+
+# --- Call budget ---
+class _TokenBucket:
+    """
+    Token bucket refilled at calls_per_minute, holding at most a minute's worth,
+    plus an optional calendar-day cap. With a budget file the state lives in
+    that file under an exclusive lock, so all workers draw from one budget.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = {}
+
+    def reset(self):
+        with self._lock:
+            self._state = {}
+
+    def _refill(self, state, now):
+        capacity = _settings['calls_per_minute']
+        tokens = state.get('tokens', capacity)
+        elapsed = max(0.0, now - state.get('updated', now))
+        state['tokens'] = min(capacity, tokens + elapsed * capacity / 60.0)
+        state['updated'] = now
+        day = time.strftime('%Y-%m-%d', time.gmtime(now))
+        if state.get('day') != day:
+            state['day'] = day
+            state['day_calls'] = 0
+
+    def _take(self, state, floor, now):
+        self._refill(state, now)
+        calls_per_day = _settings['calls_per_day']
+        if calls_per_day and state['day_calls'] >= calls_per_day:
+            return False
+        if state['tokens'] - 1 < floor:
+            return False
+        state['tokens'] -= 1
+        state['day_calls'] += 1
+        return True
+
+    def try_take(self, floor=0.0):
+        """Takes one token if at least `floor` tokens would be left. Returns whether it did."""
+        path = _settings['budget_file']
+        if path and fcntl is not None:
+            try:
+                return self._take_shared(path, floor)
+            except (OSError, ValueError):
+                # Unreadable budget file; fall back to this process's own bucket
+                pass
+        with self._lock:
+            return self._take(self._state, floor, time.time())
+
+    def _take_shared(self, path, floor):
+        with open(path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = json.loads(raw) if raw else {}
+                taken = self._take(state, floor, time.time())
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                return taken
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+_bucket = _TokenBucket()
+# --- End Call budget ---
+
+# --- Circuit breakers ---
+class _CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures (or on a 429) and
+    rejects calls until the reset timeout passes. Then a single trial call is
+    let through: success closes the breaker, failure opens it again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+
+    def allow(self):
+        with self._lock:
+            if self.open_until == 0.0:
+                return True
+            if time.time() < self.open_until or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def cancel_trial(self):
+        """Gives back a trial slot that was admitted but never used."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def is_open(self):
+        return self.open_until != 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = 0.0
+            self.trial_in_flight = False
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if retry_after is not None or self.failures >= _settings['failure_threshold']:
+                self.open_until = time.time() + (retry_after or _settings['reset_timeout'])
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def _breaker(endpoint):
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = _CircuitBreaker()
+        return breaker
+# --- End Circuit breakers ---
+
+def _admit(endpoint, priority):
+    """Checks the breaker. Returns it with the token floor and wait deadline for the priority."""
+    breaker = _breaker(endpoint)
+    if not breaker.allow():
+        raise UpstreamUnavailable(endpoint, 'circuit_open')
+    floor = _settings['reserve'].get(priority, 0.0) * _settings['calls_per_minute']
+    deadline = time.time() + (_settings['max_wait'] if priority == USER else 0)
+    return breaker, floor, deadline
+
+def _next_wait(endpoint, breaker, deadline):
+    """Returns how long to wait before retrying for a token, or raises if out of time."""
+    if time.time() >= deadline:
+        breaker.cancel_trial()
+        raise UpstreamUnavailable(endpoint, 'rate_limited')
+    return min(0.1, max(0.0, deadline - time.time()))
+
+def acquire(endpoint, priority=USER):
+    """
+    Admits one upstream call to `endpoint` or raises UpstreamUnavailable.
+    User-facing calls may wait up to OWM_BUDGET_MAX_WAIT seconds for a token;
+    enrichment and prefetch calls never wait and must leave a reserve in the
+    bucket for the classes above them.
+    """
+    breaker, floor, deadline = _admit(endpoint, priority)
+    while not _bucket.try_take(floor):
+        time.sleep(_next_wait(endpoint, breaker, deadline))
+
+async def acquire_async(endpoint, priority=USER):
+    """Like acquire(), but waits for a token without blocking the event loop."""
+    breaker, floor, deadline = _admit(endpoint, priority)
+    # The shared budget file is read under a lock another worker may hold, so take tokens off the loop
+    shared = bool(_settings['budget_file'])
+    while True:
+        taken = await asyncio.to_thread(_bucket.try_take, floor) if shared else _bucket.try_take(floor)
+        if taken:
+            return
+        await asyncio.sleep(_next_wait(endpoint, breaker, deadline))
+
+def record_success(endpoint):
+    _breaker(endpoint).record_success()
+
+def record_failure(endpoint, response=None):
+    """
+    Counts a failed call against the endpoint's breaker. Only throttling,
+    server errors and network failures count; a 404 is a valid answer.
+    """
+    retry_after = None
+    if response is not None:
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers.get('Retry-After', _settings['reset_timeout']))
+            except ValueError:
+                retry_after = _settings['reset_timeout']
+        elif response.status_code < 500:
+            _breaker(endpoint).record_success()
+            return
+    _breaker(endpoint).record_failure(retry_after)
+
+def is_open(endpoint):
+    """Returns True while the endpoint's circuit breaker is rejecting calls."""
+    return _breaker(endpoint).is_open()
+
+@metrics.collector
+def _collect_metrics():
+    with _breakers_lock:
+        endpoints = list(_breakers)
+    for endpoint in endpoints:
+        metrics.UPSTREAM_CIRCUIT_OPEN.set(int(is_open(endpoint)), endpoint=endpoint)
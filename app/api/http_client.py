@@ -0,0 +1,137 @@
+import asyncio
+import inspect
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from app.config import Config
+
+# Retry jitter arrived in urllib3 2.0; requests also runs on 1.26
+_RETRY_HAS_JITTER = 'backoff_jitter' in inspect.signature(Retry.__init__).parameters
+
+try:
+    import httpx
+except ImportError:  # Optional; without it async calls run the sync session in a thread
+    httpx = None
+
+# Settings used until init_app() is called with the Flask config.
+_settings = {
+    'pool_connections': Config.HTTP_POOL_CONNECTIONS,
+    'pool_maxsize': Config.HTTP_POOL_MAXSIZE,
+    'connect_timeout': Config.HTTP_CONNECT_TIMEOUT,
+    'read_timeout': Config.HTTP_READ_TIMEOUT,
+    'max_retries': Config.HTTP_MAX_RETRIES,
+    'backoff_factor': Config.HTTP_BACKOFF_FACTOR,
+    'async_max_connections': Config.HTTP_ASYNC_MAX_CONNECTIONS,
+}
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+def init_app(app):
+    """Reads pool sizes, timeouts and retry settings from the app config."""
+    global _session
+    _settings.update({
+        'pool_connections': app.config.get('HTTP_POOL_CONNECTIONS', _settings['pool_connections']),
+        'pool_maxsize': app.config.get('HTTP_POOL_MAXSIZE', _settings['pool_maxsize']),
+        'connect_timeout': app.config.get('HTTP_CONNECT_TIMEOUT', _settings['connect_timeout']),
+        'read_timeout': app.config.get('HTTP_READ_TIMEOUT', _settings['read_timeout']),
+        'max_retries': app.config.get('HTTP_MAX_RETRIES', _settings['max_retries']),
+        'backoff_factor': app.config.get('HTTP_BACKOFF_FACTOR', _settings['backoff_factor']),
+        'async_max_connections': app.config.get('HTTP_ASYNC_MAX_CONNECTIONS', _settings['async_max_connections']),
+    })
+    # Drop any session built with the old settings; the next call makes a new one.
+    with _lock:
+        _session = None
+
+def _build_session():
+    """Creates a keep-alive session with a bounded connection pool."""
+    # Only failed connections are retried: those never reached the upstream.
+    # A request that did (a read timeout or a 5xx) is one governed call, so it
+    # is left to the call governor's budget and circuit breaker, as with httpx
+    # below. The jitter spreads retries from many workers so they don't hit
+    # the upstream in lockstep.
+    retry_options = {}
+    if _RETRY_HAS_JITTER:
+        retry_options['backoff_jitter'] = _settings['backoff_factor']
+    retry = Retry(
+        total=_settings['max_retries'],
+        connect=_settings['max_retries'],
+        read=0,
+        status=0,
+        backoff_factor=_settings['backoff_factor'],
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+        **retry_options,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=_settings['pool_connections'],
+        pool_maxsize=_settings['pool_maxsize'],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+def get_session():
+    """Returns the session for this process, creating it on first use."""
+    global _session, _session_pid
+    # Sockets must not be shared with a forked gunicorn worker, so the
+    # session is rebuilt whenever the process id changes.
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+def get(url, params=None):
+    """Performs a GET request on the shared session with the configured timeouts."""
+    timeout = (_settings['connect_timeout'], _settings['read_timeout'])
+    return get_session().get(url, params=params, timeout=timeout)
+
+# --- Async client ---
+# One httpx client per event loop (clients can't be shared between loops).
+# httpx only retries failed connections, not 5xx responses.
+_async_clients = {}
+
+def _get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(_settings['read_timeout'], connect=_settings['connect_timeout']),
+            limits=httpx.Limits(
+                max_connections=_settings['async_max_connections'],
+                max_keepalive_connections=_settings['pool_maxsize'],
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=_settings['max_retries']),
+            headers={'Accept-Encoding': 'gzip, deflate'},
+        )
+    return client
+
+async def aget(url, params=None):
+    """
+    Async GET with the configured timeouts. Transport errors are raised as
+    requests exceptions, so callers handle both clients the same way.
+    """
+    if httpx is None:
+        return await asyncio.to_thread(get, url, params)
+    try:
+        return await _get_async_client().get(url, params=params)
+    except httpx.TimeoutException as e:
+        raise requests.exceptions.Timeout(str(e)) from e
+    except httpx.HTTPError as e:
+        raise requests.exceptions.ConnectionError(str(e)) from e
+
+async def aclose():
+    """Closes the async client of the running event loop, if it has one."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+# --- End Async client ---
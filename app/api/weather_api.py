@@ -1,27 +1,100 @@
-import requests
 import os
+import time
+import requests
+from app.api import governor, http_client
+from app.utils import metrics
 
 API_KEY = os.environ.get('API_KEY')
-BASE_URL = "http://api.openweathermap.org/data/2.5/"
-BASE_URL_AIR = "http://api.openweathermap.org/data/2.5/air_pollution"
-BASE_URL_UV = "http://api.openweathermap.org/data/2.5/uvi"
-BASE_URL_GEO = "http://api.openweathermap.org/geo/1.0/direct"
+# Point this at another host (e.g. the fake server in benchmarks/) to run without the real API
+OWM_BASE_URL = os.environ.get('OWM_BASE_URL', 'http://api.openweathermap.org').rstrip('/')
+BASE_URL = f"{OWM_BASE_URL}/data/2.5/"
+BASE_URL_AIR = f"{OWM_BASE_URL}/data/2.5/air_pollution"
+BASE_URL_UV = f"{OWM_BASE_URL}/data/2.5/uvi"
+BASE_URL_GEO = f"{OWM_BASE_URL}/geo/1.0/direct"
 
+def _record_error(endpoint, error):
+    """Counts a failed call against the endpoint's circuit breaker and in the metrics."""
+    if isinstance(error, requests.exceptions.HTTPError):
+        governor.record_failure(endpoint, error.response)
+        reason = error.response.status_code
+    else:
+        governor.record_failure(endpoint)
+        reason = 'timeout' if isinstance(error, requests.exceptions.Timeout) else 'network'
+    metrics.UPSTREAM_ERRORS.inc(endpoint=endpoint, reason=reason)
 
-def get_uv_index(lat, lon):
-    """Fetches UV Index data for given coordinates."""
+def _get_json(endpoint, url, params, priority=governor.USER):
+    """
+    Performs an upstream call through the call governor, recording its latency
+    and any error under `endpoint`. Raises governor.UpstreamUnavailable without
+    calling out if the budget is spent or the endpoint's circuit is open.
+    """
+    try:
+        governor.acquire(endpoint, priority)
+    except governor.UpstreamUnavailable as e:
+        metrics.UPSTREAM_REJECTED.inc(endpoint=endpoint, reason=e.reason)
+        raise
+
+    start = time.perf_counter()
+    try:
+        with metrics.UPSTREAM_REQUESTS_IN_FLIGHT.track():
+            response = http_client.get(url, params=params)
+        response.raise_for_status()
+        data = response.json()
+    except requests.exceptions.RequestException as e:
+        _record_error(endpoint, e)
+        raise
+    finally:
+        metrics.UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - start, endpoint=endpoint)
+    governor.record_success(endpoint)
+    return data
+
+async def _get_json_async(endpoint, url, params, priority=governor.USER):
+    """Like _get_json(), but awaits the call so the event loop can serve others meanwhile."""
+    try:
+        await governor.acquire_async(endpoint, priority)
+    except governor.UpstreamUnavailable as e:
+        metrics.UPSTREAM_REJECTED.inc(endpoint=endpoint, reason=e.reason)
+        raise
+
+    start = time.perf_counter()
+    try:
+        with metrics.UPSTREAM_REQUESTS_IN_FLIGHT.track():
+            response = await http_client.aget(url, params=params)
+        if response.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{response.status_code} Error for url: {url}", response=response)
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise requests.exceptions.InvalidJSONError(str(e), response=response) from e
+    except requests.exceptions.RequestException as e:
+        _record_error(endpoint, e)
+        raise
+    finally:
+        metrics.UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - start, endpoint=endpoint)
+    governor.record_success(endpoint)
+    return data
+
+# Each call is described by a request builder returning (endpoint, url, params),
+# shared by the sync functions and their async variants.
+
+def _uv_index_request(lat, lon):
     url = f"{BASE_URL_UV}"
     params = {
         'lat': lat,
         'lon': lon,
         'appid': API_KEY
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+    return 'uvi', url, params
 
-def get_current_weather(city):
-    """Fetches current weather data for a given city."""
+def get_uv_index(lat, lon, priority=governor.ENRICH):
+    """Fetches UV Index data for given coordinates."""
+    return _get_json(*_uv_index_request(lat, lon), priority)
+
+async def get_uv_index_async(lat, lon, priority=governor.ENRICH):
+    """Async variant of get_uv_index()."""
+    return await _get_json_async(*_uv_index_request(lat, lon), priority)
+
+def _current_weather_request(city):
     if not API_KEY:
         raise ValueError("API_KEY not set in environment variables")
 
@@ -31,12 +104,36 @@ def get_current_weather(city):
         'appid': API_KEY,
         'units': 'metric'  # For Celsius
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+    return 'weather', url, params
 
-def get_forecast(city):
-    """Fetches 5-day weather forecast data for a given city."""
+def get_current_weather(city, priority=governor.USER):
+    """Fetches current weather data for a given city."""
+    return _get_json(*_current_weather_request(city), priority)
+
+async def get_current_weather_async(city, priority=governor.USER):
+    """Async variant of get_current_weather()."""
+    return await _get_json_async(*_current_weather_request(city), priority)
+
+# OWM's group endpoint accepts at most this many city IDs per call
+GROUP_MAX_IDS = 20
+
+def _current_weather_group_request(city_ids):
+    if not API_KEY:
+        raise ValueError("API_KEY not set in environment variables")
+
+    url = f"{BASE_URL}group"
+    params = {
+        'id': ','.join(str(city_id) for city_id in city_ids[:GROUP_MAX_IDS]),
+        'appid': API_KEY,
+        'units': 'metric'
+    }
+    return 'group', url, params
+
+def get_current_weather_group(city_ids, priority=governor.PREFETCH):
+    """Fetches current weather for up to 20 cities by OWM city ID in one call."""
+    return _get_json(*_current_weather_group_request(city_ids), priority)
+
+def _forecast_request(city):
     if not API_KEY:
         raise ValueError("API_KEY not set in environment variables")
 
@@ -46,12 +143,17 @@ def get_forecast(city):
         'appid': API_KEY,
         'units': 'metric'
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+    return 'forecast', url, params
 
-def get_weather_by_coords(lat, lon):
-    """Fetches weather data using latitude and longitude."""
+def get_forecast(city, priority=governor.USER):
+    """Fetches 5-day weather forecast data for a given city."""
+    return _get_json(*_forecast_request(city), priority)
+
+async def get_forecast_async(city, priority=governor.USER):
+    """Async variant of get_forecast()."""
+    return await _get_json_async(*_forecast_request(city), priority)
+
+def _weather_by_coords_request(lat, lon):
     url = f"{BASE_URL}weather"
     params = {
         'lat': lat,
@@ -59,12 +161,17 @@ def get_weather_by_coords(lat, lon):
         'appid': API_KEY,
         'units': 'metric'
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+    return 'weather', url, params
 
-def get_forecast_by_coords(lat, lon):
-    """Fetches forecast data using latitude and longitude."""
+def get_weather_by_coords(lat, lon, priority=governor.USER):
+    """Fetches weather data using latitude and longitude."""
+    return _get_json(*_weather_by_coords_request(lat, lon), priority)
+
+async def get_weather_by_coords_async(lat, lon, priority=governor.USER):
+    """Async variant of get_weather_by_coords()."""
+    return await _get_json_async(*_weather_by_coords_request(lat, lon), priority)
+
+def _forecast_by_coords_request(lat, lon):
     url = f"{BASE_URL}forecast"
     params = {
         'lat': lat,
@@ -72,30 +179,42 @@ def get_forecast_by_coords(lat, lon):
         'appid': API_KEY,
         'units': 'metric'
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+    return 'forecast', url, params
 
-def get_air_pollution(lat, lon):
-    """Fetches air pollution data for given coordinates."""
+def get_forecast_by_coords(lat, lon, priority=governor.USER):
+    """Fetches forecast data using latitude and longitude."""
+    return _get_json(*_forecast_by_coords_request(lat, lon), priority)
+
+async def get_forecast_by_coords_async(lat, lon, priority=governor.USER):
+    """Async variant of get_forecast_by_coords()."""
+    return await _get_json_async(*_forecast_by_coords_request(lat, lon), priority)
+
+def _air_pollution_request(lat, lon):
     url = f"{BASE_URL_AIR}"
     params = {
         'lat': lat,
         'lon': lon,
         'appid': API_KEY
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
+    return 'air_pollution', url, params
 
-def geocode_city(city_name):
-    """Finds cities matching a partial name using the Geocoding API."""
+def get_air_pollution(lat, lon, priority=governor.ENRICH):
+    """Fetches air pollution data for given coordinates."""
+    return _get_json(*_air_pollution_request(lat, lon), priority)
+
+async def get_air_pollution_async(lat, lon, priority=governor.ENRICH):
+    """Async variant of get_air_pollution()."""
+    return await _get_json_async(*_air_pollution_request(lat, lon), priority)
+
+def _geocode_city_request(city_name):
     url = f"{BASE_URL_GEO}"
     params = {
         'q': f"{city_name},BD", # Restrict search to Bangladesh
         'limit': 5, # Get up to 5 suggestions
         'appid': API_KEY
     }
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    return response.json()
\ No newline at end of file
+    return 'geocode', url, params
+
+def geocode_city(city_name, priority=governor.USER):
+    """Finds cities matching a partial name using the Geocoding API."""
+    return _get_json(*_geocode_city_request(city_name), priority)
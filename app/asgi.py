@@ -0,0 +1,199 @@
+"""
+ASGI entry point that keeps upstream waits off the worker threads.
+
+Flask is a WSGI app, and its async views still hold a worker for the whole
+request. Here an asyncio front end warms the cache first, awaiting the
+OpenWeatherMap calls with the async client, and only then hands the request
+to Flask in a thread. Flask then finds the data in the cache and answers
+in milliseconds, so one process can wait on hundreds of upstream calls
+without hundreds of threads.
+
+    uvicorn asgi:application --workers 4
+
+Only the page and weather endpoints are warmed; everything else goes straight
+to Flask. Flask runs on a pool of ASGI_BRIDGE_THREADS threads. Streaming
+responses (/api/weather/stream) hold a thread each for as long as they are
+open, so they are read on a separate pool of ASGI_STREAM_THREADS and answered
+with a 503 once it is full, rather than starving ordinary requests.
+"""
+import asyncio
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs
+
+from app.api import http_client
+from app.services import weather_service
+
+logger = logging.getLogger(__name__)
+
+def _query(scope):
+    return {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+# path -> coroutine function warming the cache for a request (called with the query args)
+def _warm_index(args):
+    return weather_service.get_weather_data_async("Dhaka")
+
+def _warm_city(args):
+    return weather_service.get_weather_data_async(args.get('city', '').strip() or "Dhaka")
+
+def _warm_coords(args):
+    if not args.get('lat') or not args.get('lon'):
+        return None
+    return weather_service.get_weather_by_coords_async(args['lat'], args['lon'])
+
+WARMERS = {
+    '/': _warm_index,
+    '/weather': _warm_city,
+    '/weather-by-coords': _warm_coords,
+}
+
+class AsyncWeatherApp:
+    """Wraps the Flask app as an ASGI app that warms the cache before each weather request."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.bridge_executor = ThreadPoolExecutor(
+            max_workers=flask_app.config.get('ASGI_BRIDGE_THREADS', 32), thread_name_prefix='asgi-bridge')
+        self.stream_slots = flask_app.config.get('ASGI_STREAM_THREADS', 16)
+        self.stream_executor = ThreadPoolExecutor(max_workers=self.stream_slots, thread_name_prefix='asgi-stream')
+        self.open_streams = 0  # Only touched on the event loop
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+        await self._warm(scope)
+        await self._call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await http_client.aclose()
+                self.bridge_executor.shutdown(wait=False)
+                self.stream_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _warm(self, scope):
+        warmer = WARMERS.get(scope['path'])
+        if warmer is None or scope['method'] != 'GET':
+            return
+        try:
+            with self.flask_app.app_context():
+                coroutine = warmer(_query(scope))
+                if coroutine is not None:
+                    await coroutine
+        except Exception:
+            # Flask will try again on its own; warming is only an optimisation
+            logger.exception("Cache warm-up failed", extra={'path': scope['path']})
+
+    # --- WSGI bridge ---
+    def _environ(self, scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = f'HTTP_{name}'
+            # Repeated headers are joined with commas, except cookies, which use "; "
+            separator = '; ' if name == 'COOKIE' else ','
+            environ[key] = f'{environ[key]}{separator}{value}' if key in environ else value
+        return environ
+
+    @staticmethod
+    def _is_stream(headers):
+        return any(name.lower() == b'content-type' and value.startswith(b'text/event-stream')
+                   for name, value in headers)
+
+    async def _call_wsgi(self, scope, receive, send):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self.bridge_executor, self.flask_app.wsgi_app, self._environ(scope, body), start_response)
+        executor = self.bridge_executor
+        is_stream = self._is_stream(started['headers'])
+        if is_stream:
+            if self.open_streams >= self.stream_slots:
+                # The generator hasn't started yet, so closing it here is cheap
+                if hasattr(result, 'close'):
+                    await loop.run_in_executor(self.bridge_executor, result.close)
+                return await self._send_busy(send)
+            executor = self.stream_executor
+            self.open_streams += 1
+        # The server drops sends once the client has gone, so a stream has to
+        # watch for the disconnect itself or it would run until SSE_MAX_DURATION
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive)) if is_stream else None
+        chunks = iter(result)
+        done = object()
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+            while True:
+                pending = loop.run_in_executor(executor, next, chunks, done)
+                if disconnected is not None:
+                    await asyncio.wait((pending, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                chunk = await pending
+                if chunk is done or (disconnected is not None and disconnected.done()):
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not (disconnected is not None and disconnected.done()):
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            try:
+                if disconnected is not None:
+                    disconnected.cancel()
+                # Runs the generator's cleanup (e.g. the pubsub unsubscribe). It can't be
+                # closed while a thread is inside it, hence waiting for `pending` above.
+                if hasattr(result, 'close'):
+                    await loop.run_in_executor(executor, result.close)
+            finally:
+                if is_stream:
+                    self.open_streams -= 1
+
+    @staticmethod
+    async def _wait_for_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _send_busy(self, send):
+        await send({'type': 'http.response.start', 'status': 503,
+                    'headers': [(b'content-type', b'application/json'), (b'retry-after', b'5')]})
+        await send({'type': 'http.response.body', 'body': b'{"error": "Too many live streams. Please try again later."}'})
+    # --- End WSGI bridge ---
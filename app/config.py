@@ -10,7 +10,92 @@ class Config:
     STATIC_FOLDER = 'static'
     TEMPLATES_FOLDER = 'templates'
     CACHE_TIMEOUT = 600  # Cache timeout in seconds (10 minutes)
-    # We will use a simple file-based cache, so no DB URI needed for now.
+    # Stale-while-revalidate: after the soft TTL an entry is served as-is while it
+    # refreshes in the background; after the hard TTL it's no longer served.
+    CACHE_SOFT_TTL = CACHE_TIMEOUT
+    CACHE_HARD_TTL = 3600  # 1 hour
+    CACHE_MEMORY_MAX_ENTRIES = 256  # Entries kept in the in-process LRU tier
+    # Persistent cache tier: 'file' (one JSON file per key) or 'sqlite' (one WAL database,
+    # safe to share between gunicorn workers, with expiry and size-bounded eviction)
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'file')
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH')  # Defaults to cache/cache.db
+    CACHE_MAX_ENTRIES = 5000  # Size bound for the sqlite backend
+    CACHE_LAST_KNOWN_GRACE = 7 * 24 * 3600  # Seconds the sqlite backend keeps expired entries to serve when the upstream fails
+    # Each part of a weather entry expires on its own; a refresh refetches only the
+    # expired parts. Current conditions should have the shortest TTL (the soft TTL).
+    CURRENT_TTL = CACHE_SOFT_TTL
+    FORECAST_TTL = 3600  # OWM updates the 3-hourly forecast about hourly
+    AQI_TTL = 3600
+    UVI_TTL = 3 * 3600
+    MOON_TTL = 24 * 3600  # Also expires at the location's local midnight
+    # Failed lookups are remembered briefly so repeats don't go upstream
+    NEGATIVE_CACHE_TTL = 300  # Unknown city names (404)
+    FAILURE_CACHE_TTL = 30  # Other failures, and optional parts (UV/AQI) that failed to load
+    NEGATIVE_CACHE_MAX_ENTRIES = 1024
+    COORD_GRID_SIZE = 0.01  # Geolocation coordinates are snapped to this grid (degrees, ~1.1 km)
+    COORD_REUSE_RADIUS_KM = 5  # Reuse a fresh entry this close instead of fetching
+    # Also coalesce cache misses across gunicorn workers with a lock file in the cache directory
+    SINGLEFLIGHT_FILE_LOCK = os.environ.get('SINGLEFLIGHT_FILE_LOCK', 'false').lower() == 'true'
+    BATCH_MAX_ITEMS = 20  # Locations accepted by /api/weather/batch
+
+    RENDER_CACHE_MAX_ENTRIES = 64  # Rendered index pages kept in memory
+
+    # Live updates over Server-Sent Events (/api/weather/stream)
+    SSE_HEARTBEAT = 30  # Seconds between keepalives (and cache checks) on an idle stream
+    SSE_MAX_DURATION = 1800  # Streams are closed after this long; browsers reconnect
+
+    # Response compression (gzip, or brotli if installed)
+    COMPRESS_MIN_SIZE = 500  # Bytes; smaller bodies are sent as-is
+    COMPRESS_LEVEL = 6
+    COMPRESS_CACHE_MAX_ENTRIES = 256  # Compressed bodies kept so each is compressed once
+
+    # Background prefetching of popular cities
+    PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'false').lower() == 'true'
+    PREFETCH_CITIES = ['Dhaka', 'Chittagong', 'Khulna', 'Rajshahi', 'Sylhet', 'Barisal', 'Rangpur', 'Mymensingh']
+    PREFETCH_INTERVAL = 60  # Seconds between refresh cycles
+    PREFETCH_LEAD_TIME = 60  # Refresh entries this many seconds before they go stale
+    PREFETCH_CALLS_PER_MINUTE = 30  # Upstream calls the prefetcher may spend per minute
+    PREFETCH_MAX_LEARNED = 20  # Most-requested cities added to the hot set
+    PREFETCH_SCORE_DECAY = 0.9  # Request counts are multiplied by this every cycle
+
+    # Upstream HTTP client (shared, keep-alive session per process)
+    HTTP_POOL_CONNECTIONS = 4  # Number of hosts to keep pools for
+    HTTP_POOL_MAXSIZE = 16  # Connections kept alive per host
+    HTTP_CONNECT_TIMEOUT = 3.05  # Seconds to establish a connection
+    HTTP_READ_TIMEOUT = 10  # Seconds to wait for the server to send data
+    HTTP_MAX_RETRIES = 2  # Retries for connections that failed (5xx responses are not retried)
+    HTTP_BACKOFF_FACTOR = 0.3  # Base delay in seconds between retries
+    HTTP_ASYNC_MAX_CONNECTIONS = 100  # Upstream connections the async client may open (ASGI mode)
+
+    # ASGI front end (app/asgi.py)
+    ASGI_BRIDGE_THREADS = 32  # Threads handing requests to Flask
+    ASGI_STREAM_THREADS = 16  # Live streams served at once; each holds a thread, more get a 503
+
+    # Upstream call governor: a token bucket shared by all calls, with reserves so
+    # user-facing calls come before UV/AQI enrichment, and enrichment before prefetch
+    OWM_CALLS_PER_MINUTE = int(os.environ.get('OWM_CALLS_PER_MINUTE', 60))  # OWM free plan limit
+    OWM_CALLS_PER_DAY = 0  # 0 means no daily cap
+    OWM_BUDGET_FILE = os.environ.get('OWM_BUDGET_FILE')  # Share the budget between workers via this file
+    OWM_BUDGET_MAX_WAIT = 2  # Seconds a user-facing call may wait for a token
+    OWM_ENRICH_RESERVE = 0.1  # Fraction of the bucket UV/AQI calls must leave for user calls
+    OWM_PREFETCH_RESERVE = 0.3  # Fraction of the bucket prefetch calls must leave for the others
+    BREAKER_FAILURE_THRESHOLD = 5  # Consecutive failures that open an endpoint's circuit
+    BREAKER_RESET_TIMEOUT = 30  # Seconds an open circuit waits before a trial call
+
+    # Observation history: every fresh reading is appended to a per-location time
+    # series (see app/utils/history.py), queried at /api/history
+    HISTORY_ENABLED = os.environ.get('HISTORY_ENABLED', 'true').lower() == 'true'
+    HISTORY_DIR = os.environ.get('HISTORY_DIR', os.path.join('cache', 'history'))
+    HISTORY_RETENTION_DAYS = 90  # Days kept before they are deleted
+    HISTORY_RAW_DAYS = 7  # Days kept at full resolution; older ones are averaged
+    HISTORY_DOWNSAMPLE_SECONDS = 3600  # Bucket size for averaged days (should divide a day)
+    HISTORY_COMPACT_INTERVAL = 3600  # Seconds between compaction passes in each worker
+    HISTORY_MAX_RANGE = 31 * 24 * 3600  # Longest range one /api/history request may ask for
+
+    # Logging and metrics (Prometheus text format at /metrics)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+    # The cache talks to SQLite directly (see CACHE_BACKEND), so no DB URI needed for now.
     # But we can set it up for future use.
     # SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///shamiran.db'
     # SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -1,43 +1,98 @@
+import hashlib
 import os
+import queue
+import time
 import requests
-from flask import Blueprint, render_template, request, jsonify
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, render_template, request, jsonify, stream_with_context
 
 main_bp = Blueprint('main', __name__)
 
 from app.api import weather_api
-from app.services import weather_service
-from app.utils import helpers
+from app.services import weather_service, prefetch_service, projection
+from app.utils import gazetteer, helpers, history, metrics, pubsub
+from app.utils.lru import LRUCache
 
-@main_bp.route('/')
-def index():
-    """Homepage with default weather for Dhaka."""
-    city = "Dhaka"
-    data = weather_service.get_weather_data(city)
-    # Pass the initial condition to the template
-    initial_condition = data.get('current', {}).get('weather', [{}])[0].get('main', 'Clear')
+def _weather_json(data):
+    """
+    Returns weather data as JSON with validators derived from the cache entry.
+    A client that already holds this snapshot gets a bodiless 304.
+    Clients can ask for a subset with ?fields=current.main,aqi
+    """
+    fields = request.args.get('fields', '').strip()
+    updated_at = data.get('updated_at')
+    if data.get('error') or not updated_at:
+        return jsonify(projection.select_fields(data, fields) if fields else data)
 
-    city_name_from_api = data.get('current', {}).get('name', city)
+    # The snapshot is identified by its location, the time it was stored and the fields sent
+    current = data.get('current') or {}
+    etag = hashlib.sha1(f"{current.get('id')}:{current.get('coord')}:{updated_at}:{fields}".encode()).hexdigest()
+    soft_ttl = current_app.config.get('CACHE_SOFT_TTL', current_app.config.get('CACHE_TIMEOUT', 600))
+    max_age = int(max(0, soft_ttl - (time.time() - updated_at)))
 
-    # Format sunrise and sunset times
-    sunrise_time = None
-    sunset_time = None
-    if data.get('current') and data.get('current').get('sys'):
-        try:
-            sunrise_time = helpers.format_unix_timestamp(data['current']['sys']['sunrise'], data['current']['timezone'])
-            sunset_time = helpers.format_unix_timestamp(data['current']['sys']['sunset'], data['current']['timezone'])
-        except (KeyError, TypeError):
-            pass # Ignore if data is missing
+    if request.if_none_match.contains_weak(etag):
+        # Skip serialising the payload altogether
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(projection.select_fields(data, fields) if fields else data)
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(updated_at, timezone.utc)
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+# Rendered index pages keyed by the cache snapshot they show and the URL they
+# were rendered for (base.html puts request.url in the og:/twitter: tags). A
+# refresh gives the snapshot a new updated_at, so stale pages are simply never
+# looked up again.
+_rendered_pages = LRUCache(max_entries=64)
+
+def _render_weather_page(data, fallback_city):
+    """Renders index.html for the data, reusing the HTML if this snapshot was already rendered."""
+    start = time.perf_counter()
+    current = data.get('current', {})
+    city_name_from_api = current.get('name', fallback_city)
+
+    page_key = None
+    if data.get('updated_at') and not data.get('error'):
+        page_key = (current.get('id'), str(current.get('coord')), data['updated_at'], city_name_from_api, request.url)
+        _rendered_pages.max_entries = current_app.config.get('RENDER_CACHE_MAX_ENTRIES', _rendered_pages.max_entries)
+        html = _rendered_pages.get(page_key)
+        if html is not None:
+            metrics.RENDER_DURATION.observe(time.perf_counter() - start, cached='true')
+            return html
+
+    # Pass the initial condition to the template
+    initial_condition = current.get('weather', [{}])[0].get('main', 'Clear')
 
     context = {
         'data': data, 
         'default_city': city_name_from_api,
         'initial_condition': initial_condition,
-        'sunrise_time': sunrise_time,
-        'sunset_time': sunset_time,
+        # Sunrise and sunset are formatted when the cache is filled
+        'sunrise_time': current.get('formatted_sunrise'),
+        'sunset_time': current.get('formatted_sunset'),
         'config': {'API_KEY': os.environ.get('API_KEY')},
         'show_map': False  # Default to hidden
     }
-    return render_template('index.html', **context)
+    html = render_template('index.html', **context)
+    if page_key is not None:
+        _rendered_pages.set(page_key, html, ttl=current_app.config.get('CACHE_HARD_TTL', 3600))
+    metrics.RENDER_DURATION.observe(time.perf_counter() - start, cached='false')
+    return html
+
+def _weather_response(data, fallback_city):
+    """JSON for AJAX requests from our JS, the full page otherwise."""
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return _weather_json(data)
+    return _render_weather_page(data, fallback_city)
+
+@main_bp.route('/')
+def index():
+    """Homepage with default weather for Dhaka."""
+    city = "Dhaka"
+    data = weather_service.get_weather_data(city)
+    prefetch_service.record_request(city)
+    return _render_weather_page(data, city)
 
 @main_bp.route('/weather')
 def get_weather():
@@ -47,51 +102,9 @@ def get_weather():
         city = "Dhaka"
     
     data = weather_service.get_weather_data(city)
-    
-    # If the request is an AJAX request (from our JS), return JSON
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        # For AJAX, we also need to format the times
-        if data.get('current') and data.get('current').get('sys'):
-            # --- (sunrise/sunset formatting) ---
-            try:
-                data['current']['formatted_sunrise'] = helpers.format_unix_timestamp(data['current']['sys']['sunrise'], data['current']['timezone'])
-                data['current']['formatted_sunset'] = helpers.format_unix_timestamp(data['current']['sys']['sunset'], data['current']['timezone'])
-            except (KeyError, TypeError):
-                data['current']['formatted_sunrise'] = 'N/A'
-                data['current']['formatted_sunset'] = 'N/A'
-                
-        # Add formatted alert times for AJAX
-        if data.get('current') and data.get('current').get('alerts'):
-            for alert in data['current']['alerts']:
-                alert['formatted_start'] = helpers.format_unix_timestamp(alert['start'], data['current']['timezone'])
-                alert['formatted_end'] = helpers.format_unix_timestamp(alert['end'], data['current']['timezone'])
-        
-        return jsonify(data)
-    
-    initial_condition = data.get('current', {}).get('weather', [{}])[0].get('main', 'Clear')
-    
-    city_name_from_api = data.get('current', {}).get('name', city)
-    
-    # Format sunrise and sunset for non-AJAX
-    sunrise_time = None
-    sunset_time = None
-    if data.get('current') and data.get('current').get('sys'):
-        try:
-            sunrise_time = helpers.format_unix_timestamp(data['current']['sys']['sunrise'], data['current']['timezone'])
-            sunset_time = helpers.format_unix_timestamp(data['current']['sys']['sunset'], data['current']['timezone'])
-        except (KeyError, TypeError):
-            pass
-
-    context = {
-        'data': data, 
-        'default_city': city_name_from_api,
-        'initial_condition': initial_condition,
-        'sunrise_time': sunrise_time,
-        'sunset_time': sunset_time,
-        'config': {'API_KEY': os.environ.get('API_KEY')},
-        'show_map': False  # Default to hidden
-    }
-    return render_template('index.html', **context)
+    if not data.get('error'):
+        prefetch_service.record_request(city)
+    return _weather_response(data, city)
 
 @main_bp.route('/weather-by-coords')
 def weather_by_coords():
@@ -103,49 +116,7 @@ def weather_by_coords():
         return jsonify({"error": "Location coordinates not provided."})
 
     data = weather_service.get_weather_by_coords(lat, lon)
-    
-    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        if data.get('current') and data.get('current').get('sys'):
-            try:
-                data['current']['formatted_sunrise'] = helpers.format_unix_timestamp(data['current']['sys']['sunrise'], data['current']['timezone'])
-                data['current']['formatted_sunset'] = helpers.format_unix_timestamp(data['current']['sys']['sunset'], data['current']['timezone'])
-            except (KeyError, TypeError):
-                data['current']['formatted_sunrise'] = 'N/A'
-                data['current']['formatted_sunset'] = 'N/A'
-                
-        # Add formatted alert times for AJAX
-        if data.get('current') and data.get('current').get('alerts'):
-            for alert in data['current']['alerts']:
-                alert['formatted_start'] = helpers.format_unix_timestamp(alert['start'], data['current']['timezone'])
-                alert['formatted_end'] = helpers.format_unix_timestamp(alert['end'], data['current']['timezone'])
-                
-        return jsonify(data)
-    
-    # Fallback for non-AJAX requests
-    initial_condition = data.get('current', {}).get('weather', [{}])[0].get('main', 'Clear')
-    
-    city_name_from_api = data.get('current', {}).get('name', 'Unknown')
-    
-    # Format sunrise and sunset for non-AJAX
-    sunrise_time = None
-    sunset_time = None
-    if data.get('current') and data.get('current').get('sys'):
-        try:
-            sunrise_time = helpers.format_unix_timestamp(data['current']['sys']['sunrise'], data['current']['timezone'])
-            sunset_time = helpers.format_unix_timestamp(data['current']['sys']['sunset'], data['current']['timezone'])
-        except (KeyError, TypeError):
-            pass
-
-    context = {
-        'data': data, 
-        'default_city': city_name_from_api,
-        'initial_condition': initial_condition,
-        'sunrise_time': sunrise_time,
-        'sunset_time': sunset_time,
-        'config': {'API_KEY': os.environ.get('API_KEY')},
-        'show_map': False  # Default to hidden
-    }
-    return render_template('index.html', **context)
+    return _weather_response(data, 'Unknown')
     
 # @main_bp.route('/api/search-suggestions')
 # def search_suggestions():
@@ -196,6 +167,123 @@ def weather_by_coords():
 #     # This is a simpler and more robust approach.
 #     pass # We'll remove this and handle it in JS.
 
+@main_bp.route('/api/weather/batch', methods=['GET', 'POST'])
+def weather_batch():
+    """
+    Weather for several locations in one request (e.g. the favorites list).
+    GET: /api/weather/batch?city=Dhaka&city=Sylhet&coords=23.81,90.41
+    POST: {"items": [{"city": "Dhaka"}, {"lat": 23.81, "lon": 90.41}]}
+    """
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        items = payload.get('items') if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            return jsonify({"error": "Expected a JSON list of items."}), 400
+    else:
+        items = [{'city': city} for city in request.args.getlist('city')]
+        for coords in request.args.getlist('coords'):
+            lat, _, lon = coords.partition(',')
+            items.append({'lat': lat, 'lon': lon})
+
+    max_items = current_app.config.get('BATCH_MAX_ITEMS', 20)
+    if len(items) > max_items:
+        return jsonify({"error": f"At most {max_items} locations per request."}), 400
+
+    return jsonify({"results": weather_service.get_weather_batch(items)})
+
+@main_bp.route('/api/weather/stream')
+def weather_stream():
+    """
+    Server-Sent Events stream of weather for a city (?city=) or location (?lat=&lon=).
+    Sends a full "snapshot" event, then a "patch" event (a JSON Merge Patch)
+    whenever the cached data for that location is refreshed. All subscribers
+    share the same cache entry and its single background refresh.
+    Each open stream holds a worker thread, so serve it with threaded or
+    async workers (e.g. gunicorn -k gthread).
+    """
+    try:
+        location = weather_service.resolve_location(request.args)
+    except ValueError:
+        return jsonify({"error": "Provide a city or valid lat/lon."}), 400
+
+    events = _weather_events(
+        location.cache_key,
+        lambda: weather_service.get_weather_at(location),
+        request.args.get('fields', '').strip(),
+        current_app.config.get('SSE_HEARTBEAT', 30),
+        current_app.config.get('SSE_MAX_DURATION', 1800),
+    )
+    return current_app.response_class(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def _weather_events(cache_key, load, fields, heartbeat, max_duration):
+    """Yields SSE messages for a cache key until max_duration has passed."""
+    updates = pubsub.subscribe(cache_key)
+    try:
+        select = (lambda data: projection.select_fields(data, fields)) if fields else (lambda data: data)
+        last = select(load())
+        # Ask EventSource to reconnect after 5s when we close the stream
+        yield f"retry: 5000\nevent: snapshot\ndata: {current_app.json.dumps(last)}\n\n"
+
+        deadline = time.time() + max_duration
+        while time.time() < deadline:
+            try:
+                data = updates.get(timeout=heartbeat)
+            except queue.Empty:
+                # A cache lookup; if the entry is stale this schedules the shared refresh
+                data = load()
+            data = select(data)
+            patch = helpers.json_merge_patch(last, data) if not data.get('error') else None
+            if patch:
+                last = data
+                yield f"event: patch\ndata: {current_app.json.dumps(patch)}\n\n"
+            else:
+                yield ": keepalive\n\n"
+    finally:
+        pubsub.unsubscribe(cache_key, updates)
+
+@main_bp.route('/api/history')
+def weather_history():
+    """
+    Recorded observations for a city (?city=) or location (?lat=&lon=), as
+    parallel arrays: {"timestamps": [...], "values": {"temp": [...], ...}}.
+    Range: ?hours=24 (the default) or ?start=&end= in unix seconds.
+    ?fields=temp,aqi picks fields; ?step=3600 averages into buckets.
+    """
+    try:
+        location = weather_service.resolve_location(request.args)
+    except ValueError:
+        return jsonify({"error": "Provide a city or valid lat/lon."}), 400
+
+    now = int(time.time())
+    try:
+        end = int(request.args.get('end', now))
+        start = int(request.args['start']) if 'start' in request.args else end - int(float(request.args.get('hours', 24)) * 3600)
+        step = int(request.args.get('step', 0))
+    except (ValueError, OverflowError):
+        # int() raises OverflowError for an infinite ?hours=
+        return jsonify({"error": "start, end, hours and step must be finite numbers."}), 400
+    if start > end:
+        return jsonify({"error": "start must not be after end."}), 400
+    if step < 0:
+        return jsonify({"error": "step must not be negative."}), 400
+    max_range = current_app.config.get('HISTORY_MAX_RANGE', 31 * 24 * 3600)
+    if end - start > max_range:
+        return jsonify({"error": f"Ask for a range of at most {max_range // 3600} hours."}), 400
+
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or history.FIELDS
+    result = history.query(location.cache_key, start, end, fields, step or None)
+    result.update({"start": start, "end": end, "step": step or None})
+    return jsonify(result)
+
+@main_bp.route('/metrics')
+def prometheus_metrics():
+    """Exposes this worker's metrics in the Prometheus text format."""
+    return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @main_bp.route('/api/search-suggestions')
 def search_suggestions():
     """Provides city name suggestions for the search bar."""
@@ -203,18 +291,25 @@ def search_suggestions():
     if not query or len(query) < 2:
         return jsonify([])
 
-    suggestions = set()
+    # Answer from the local gazetteer; only unknown names go to the Geocoding API
+    suggestions = set(gazetteer.search(query))
 
-    try:
-        # We need to create the geocode_city function in weather_api.py
-        geo_results = weather_api.geocode_city(query)
-        for result in geo_results:
-            name = result.get('name', '')
-            country = result.get('country', '')
-            # We only care about cities in Bangladesh
-            if country == 'BD':
-                suggestions.add(name) # Keep it simple, just return the city name
-    except requests.exceptions.RequestException:
-        pass
+    if not suggestions:
+        try:
+            geo_results = weather_api.geocode_city(query)
+            for result in geo_results:
+                name = result.get('name', '')
+                country = result.get('country', '')
+                # We only care about cities in Bangladesh
+                if country == 'BD' and name:
+                    suggestions.add(name) # Keep it simple, just return the city name
+                    # Remember it so the next keystroke is answered locally
+                    gazetteer.add(name)
+        except requests.exceptions.RequestException:
+            pass
+
+    # Suggested cities are likely to be requested next; count them a little
+    for name in suggestions:
+        prefetch_service.record_request(name, weight=0.1)
 
     return jsonify(sorted(list(suggestions)))
\ No newline at end of file
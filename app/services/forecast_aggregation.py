@@ -0,0 +1,77 @@
+from array import array
+from collections import Counter
+from datetime import datetime, timezone
+
+# The UI's hourly strip covers the next 5 slots (15 hours)
+NEXT_HOURS_SLOTS = 5
+
+def _to_columns(slots):
+    """Turns the list of 3-hourly forecast slots into typed column arrays."""
+    columns = {
+        'dt': array('q'),
+        'temp': array('d'),
+        'temp_min': array('d'),
+        'temp_max': array('d'),
+        'rain': array('d'),
+        'wind': array('d'),
+    }
+    conditions = []
+    for slot in slots:
+        main = slot.get('main', {})
+        temp = main.get('temp', 0.0)
+        columns['dt'].append(slot.get('dt', 0))
+        columns['temp'].append(temp)
+        columns['temp_min'].append(main.get('temp_min', temp))
+        columns['temp_max'].append(main.get('temp_max', temp))
+        columns['rain'].append((slot.get('rain') or {}).get('3h', 0.0))
+        columns['wind'].append(slot.get('wind', {}).get('speed', 0.0))
+        weather = (slot.get('weather') or [{}])[0]
+        conditions.append((weather.get('main', 'Unknown'), weather.get('icon')))
+    return columns, conditions
+
+def _rollup(columns, conditions, start, end):
+    """Summarises the slots in [start, end) of the column arrays."""
+    condition_counts = Counter(main for main, _ in conditions[start:end])
+    condition = condition_counts.most_common(1)[0][0]
+    icon = next(icon for main, icon in conditions[start:end] if main == condition)
+    count = end - start
+    return {
+        'temp_min': round(min(columns['temp_min'][start:end]), 1),
+        'temp_max': round(max(columns['temp_max'][start:end]), 1),
+        'temp_mean': round(sum(columns['temp'][start:end]) / count, 1),
+        'rain_total': round(sum(columns['rain'][start:end]), 1),
+        'wind_max': round(max(columns['wind'][start:end]), 1),
+        'condition': condition,
+        'icon': icon,
+    }
+
+def aggregate_forecast(forecast):
+    """
+    Computes daily rollups (per local calendar day) and a rollup of the next
+    15 hours from a forecast: min/max/mean temperature, total rain, peak wind
+    and the most common condition. Meant to run once, when the cache is filled.
+    """
+    slots = forecast.get('list', [])
+    if not slots:
+        return {'daily': [], 'next_hours': None}
+
+    timezone_offset = (forecast.get('city') or {}).get('timezone', 0)
+    columns, conditions = _to_columns(slots)
+
+    # Slots come sorted by time, so each local day is a contiguous run
+    days = array('q', ((dt + timezone_offset) // 86400 for dt in columns['dt']))
+    daily = []
+    start = 0
+    for i in range(1, len(days) + 1):
+        if i == len(days) or days[i] != days[start]:
+            day = datetime.fromtimestamp(days[start] * 86400, timezone.utc)
+            rollup = _rollup(columns, conditions, start, i)
+            rollup['date'] = day.strftime('%Y-%m-%d')
+            rollup['label'] = day.strftime('%a, %b %d')
+            daily.append(rollup)
+            start = i
+
+    return {
+        'daily': daily,
+        'next_hours': _rollup(columns, conditions, 0, min(NEXT_HOURS_SLOTS, len(slots))),
+    }
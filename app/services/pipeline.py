@@ -0,0 +1,89 @@
+import time
+from app.utils import metrics
+
+# A lookup is a list of named stages run in order over one shared context.
+# Stages can be swapped, added or removed without touching the others, and
+# each one is timed. Sync and async lookups share the same stage objects:
+# stages that wait on I/O override run_async(), the rest reuse run().
+
+class Stage:
+    """One step of a pipeline. Subclasses set `name` and implement run()."""
+    name = None
+
+    def run(self, ctx):
+        raise NotImplementedError
+
+    async def run_async(self, ctx):
+        return self.run(ctx)
+
+class Context:
+    """State passed from stage to stage. finish() ends the run early with a result."""
+
+    def __init__(self):
+        self.data = None
+        self.done = False
+        self.timings = {}
+
+    def finish(self, data):
+        self.data = data
+        self.done = True
+
+class Pipeline:
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = list(stages)
+
+    def _index(self, name):
+        for i, stage in enumerate(self.stages):
+            if stage.name == name:
+                return i
+        raise KeyError(f"{self.name} pipeline has no stage '{name}'")
+
+    def insert(self, stage, before=None, after=None):
+        """Adds a stage before or after the named one (at the end if neither is given)."""
+        if before is not None:
+            self.stages.insert(self._index(before), stage)
+        elif after is not None:
+            self.stages.insert(self._index(after) + 1, stage)
+        else:
+            self.stages.append(stage)
+
+    def replace(self, name, stage):
+        self.stages[self._index(name)] = stage
+
+    def remove(self, name):
+        del self.stages[self._index(name)]
+
+    def _select(self, start, stop):
+        first = self._index(start) if start else 0
+        last = self._index(stop) if stop else len(self.stages)
+        return self.stages[first:last]
+
+    def _observe(self, ctx, stage, started):
+        elapsed = time.perf_counter() - started
+        ctx.timings[stage.name] = ctx.timings.get(stage.name, 0.0) + elapsed
+        metrics.PIPELINE_STAGE_DURATION.observe(elapsed, pipeline=self.name, stage=stage.name)
+
+    def run(self, ctx, start=None, stop=None):
+        """Runs the stages from `start` up to (not including) `stop` until one finishes the context."""
+        for stage in self._select(start, stop):
+            if ctx.done:
+                break
+            started = time.perf_counter()
+            try:
+                stage.run(ctx)
+            finally:
+                self._observe(ctx, stage, started)
+        return ctx
+
+    async def run_async(self, ctx, start=None, stop=None):
+        """Like run(), awaiting each stage's run_async()."""
+        for stage in self._select(start, stop):
+            if ctx.done:
+                break
+            started = time.perf_counter()
+            try:
+                await stage.run_async(ctx)
+            finally:
+                self._observe(ctx, stage, started)
+        return ctx
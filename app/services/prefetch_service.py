@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from flask import current_app
+from app.api import weather_api
+from app.services import weather_service
+from app.utils import cache
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; every process runs its own scheduler
+    fcntl = None
+
+# Upstream calls one city refresh costs: current, forecast, UV and AQI
+CALLS_PER_REFRESH = 4
+
+# --- Hot set tracking ---
+# Observed request counts per cache key. Scores decay every cycle so the hot
+# set follows what people are looking at now, not what they looked at last week.
+_scores = {}
+_scores_lock = threading.Lock()
+
+def record_request(city, weight=1.0):
+    """Records that weather for a city was requested (or suggested)."""
+    cache_key = cache.get_cache_key(city=city)
+    if not cache_key:
+        return
+    with _scores_lock:
+        _, score = _scores.get(cache_key, (city, 0.0))
+        _scores[cache_key] = (city, score + weight)
+
+def _decay_scores(factor):
+    """Scales every score down and forgets cities that are no longer requested."""
+    with _scores_lock:
+        for cache_key, (city, score) in list(_scores.items()):
+            score *= factor
+            if score < 0.5:
+                del _scores[cache_key]
+            else:
+                _scores[cache_key] = (city, score)
+
+def get_hot_cities(config):
+    """Returns the configured cities followed by the most requested ones."""
+    cities = list(config.get('PREFETCH_CITIES', []))
+    seen = {cache.get_cache_key(city=city) for city in cities}
+    with _scores_lock:
+        observed = sorted(_scores.items(), key=lambda item: item[1][1], reverse=True)
+    for cache_key, (city, _) in observed[:config.get('PREFETCH_MAX_LEARNED', 20)]:
+        if cache_key not in seen:
+            seen.add(cache_key)
+            cities.append(city)
+    return cities
+# --- End Hot set tracking ---
+
+class _CallBudget:
+    """Sliding one-minute window of upstream calls spent on prefetching."""
+    def __init__(self):
+        self._calls = deque()
+
+    def try_spend(self, calls, per_minute):
+        now = time.time()
+        while self._calls and now - self._calls[0] >= 60:
+            self._calls.popleft()
+        if len(self._calls) + calls > per_minute:
+            return False
+        self._calls.extend([now] * calls)
+        return True
+
+_budget = _CallBudget()
+
+def run_once():
+    """
+    Refreshes hot cities whose cache entry is missing or close to expiry.
+    Must be called inside an app context. Returns the cities refreshed.
+    """
+    config = current_app.config
+    soft_ttl = config.get('CACHE_SOFT_TTL', config.get('CACHE_TIMEOUT', 600))
+    # Refresh a little before the soft TTL so users never see a stale entry
+    refresh_after = max(soft_ttl - config.get('PREFETCH_LEAD_TIME', 60), 0)
+
+    calls_per_minute = config.get('PREFETCH_CALLS_PER_MINUTE', 30)
+    due = []
+    for city in get_hot_cities(config):
+        age = cache.get_cache_age(cache.get_cache_key(city=city))
+        if age is None or age >= refresh_after:
+            due.append(city)
+
+    # Cities we already hold an entry for can be refreshed 20 at a time
+    refreshed = []
+    group_calls = -(-len(due) // weather_api.GROUP_MAX_IDS)
+    if due and _budget.try_spend(group_calls, calls_per_minute):
+        refreshed = weather_service.refresh_weather_group(due)
+
+    # The rest need the full fetch
+    for city in due:
+        if city in refreshed:
+            continue
+        if not _budget.try_spend(CALLS_PER_REFRESH, calls_per_minute):
+            logger.info("Prefetch budget exhausted for this minute")
+            break
+        started = time.time()
+        data = weather_service.refresh_weather_data(city)
+        # On an upstream failure the last known entry comes back without an error, but it is older than this call
+        if not data.get('error') and data.get('updated_at', 0) >= started:
+            refreshed.append(city)
+
+    _decay_scores(config.get('PREFETCH_SCORE_DECAY', 0.9))
+    return refreshed
+
+def run_forever(app):
+    """Runs refresh cycles every PREFETCH_INTERVAL seconds."""
+    while True:
+        with app.app_context():
+            try:
+                refreshed = run_once()
+                if refreshed:
+                    logger.info("Prefetched cities", extra={'cities': refreshed})
+            except Exception:
+                logger.exception("Prefetch cycle failed")
+        time.sleep(app.config.get('PREFETCH_INTERVAL', 60))
+
+_lock_file = None
+
+def start(app):
+    """
+    Starts the scheduler in a daemon thread.
+    With several gunicorn workers only the one that gets the lock file runs it.
+    """
+    global _lock_file
+    if fcntl is not None:
+        try:
+            lock_file = open(os.path.join(cache.CACHE_DIR, '.prefetch.lock'), 'a')
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another worker already runs the scheduler
+            lock_file.close()
+            return False
+        # Keep the file open (and locked) for the life of the process
+        _lock_file = lock_file
+
+    thread = threading.Thread(target=run_forever, args=(app,), name='weather-prefetch', daemon=True)
+    thread.start()
+    return True
@@ -0,0 +1,98 @@
+from app.utils import helpers
+
+# The upstream payloads carry many fields the UI never shows. These projections
+# keep the same shape (so templates and JS keep working) with only the fields we
+# use, and pre-format display times once, when the cache is filled.
+
+def _pick(source, keys):
+    """Copies the given keys from a dict, skipping missing ones."""
+    source = source or {}
+    return {key: source[key] for key in keys if key in source}
+
+def _project_conditions(weather):
+    return [_pick(condition, ('main', 'description', 'icon')) for condition in (weather or [])[:1]]
+
+def project_current(current):
+    """Projects an OWM current-weather response into the compact schema."""
+    timezone_offset = current.get('timezone', current.get('sys', {}).get('timezone', 0))
+    projected = {
+        'id': current.get('id'),
+        'name': current.get('name'),
+        'dt': current.get('dt'),
+        'timezone': timezone_offset,
+        'coord': _pick(current.get('coord'), ('lat', 'lon')),
+        'sys': _pick(current.get('sys'), ('country', 'sunrise', 'sunset')),
+        'main': _pick(current.get('main'), ('temp', 'feels_like', 'temp_min', 'temp_max', 'humidity', 'pressure')),
+        'weather': _project_conditions(current.get('weather')),
+        'wind': _pick(current.get('wind'), ('speed', 'deg')),
+    }
+
+    # Pre-format display times (previously redone on every AJAX hit)
+    try:
+        projected['formatted_sunrise'] = helpers.format_unix_timestamp(current['sys']['sunrise'], timezone_offset)
+        projected['formatted_sunset'] = helpers.format_unix_timestamp(current['sys']['sunset'], timezone_offset)
+    except (KeyError, TypeError):
+        projected['formatted_sunrise'] = 'N/A'
+        projected['formatted_sunset'] = 'N/A'
+
+    if current.get('alerts'):
+        projected['alerts'] = []
+        for alert in current['alerts']:
+            projected_alert = _pick(alert, ('event', 'start', 'end', 'description'))
+            try:
+                projected_alert['formatted_start'] = helpers.format_alert_timestamp(alert['start'], timezone_offset)
+                projected_alert['formatted_end'] = helpers.format_alert_timestamp(alert['end'], timezone_offset)
+            except (KeyError, TypeError):
+                pass
+            projected['alerts'].append(projected_alert)
+    return projected
+
+def project_forecast(forecast):
+    """Projects an OWM 5-day/3-hour forecast response into the compact schema."""
+    slots = []
+    for slot in forecast.get('list', []):
+        projected_slot = {
+            'dt': slot.get('dt'),
+            'dt_txt': slot.get('dt_txt'),
+            'main': _pick(slot.get('main'), ('temp', 'temp_min', 'temp_max', 'humidity')),
+            'weather': _project_conditions(slot.get('weather')),
+            'wind': _pick(slot.get('wind'), ('speed',)),
+            'pop': slot.get('pop', 0),
+        }
+        if slot.get('rain'):
+            projected_slot['rain'] = _pick(slot['rain'], ('3h',))
+        slots.append(projected_slot)
+    return {
+        'city': _pick(forecast.get('city'), ('name', 'timezone')),
+        'list': slots,
+    }
+
+def select_fields(data, fields):
+    """
+    Returns only the requested parts of the data.
+    `fields` is a comma-separated list of dotted paths, e.g. "current.main,aqi".
+    The error field is always kept.
+    """
+    selected = {'error': data.get('error')}
+    # Shorter paths first, so "current" makes "current.main" redundant
+    paths = sorted({field.strip() for field in fields.split(',') if field.strip()}, key=lambda path: path.count('.'))
+    chosen = []
+    for path in paths:
+        keys = path.split('.')
+        if any(keys[:len(prefix)] == prefix for prefix in chosen):
+            continue
+        value = data
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = selected
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+                if not isinstance(target, dict):
+                    break
+            else:
+                target[keys[-1]] = value
+                chosen.append(keys)
+    return selected
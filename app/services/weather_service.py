@@ -1,7 +1,16 @@
-from app.api import weather_api
-from app.utils import cache, moon_phase
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.api import governor, weather_api
+from app.services import forecast_aggregation, pipeline, projection
+from app.utils import cache, geo_index, history, metrics, moon_phase, pubsub, singleflight
 import requests
 
+logger = logging.getLogger(__name__)
+
 # Helper to get AQI description and color
 def get_aqi_info(aqi_value):
     """Classifies AQI value into a health level and provides a range."""
@@ -35,175 +44,735 @@ def get_pm25_info(pm25_value):
     else:
         return {"level": "☠️ Hazardous", "color": "bg-red-900", "comment": "🚨 Emergency Conditions"}
 
-def get_weather_data(city):
+# --- Concurrent fetching ---
+# A cache miss fans out to up to five upstream calls. They are mostly
+# independent, so we run them on a shared thread pool instead of one after
+# another; a miss then costs roughly the slowest two calls, not the sum of five.
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='weather-fetch')
+
+def _fetch_uvi(lat, lon, priority=governor.ENRICH):
+    """Fetches the UV index value, or None if it is not available."""
+    try:
+        uvi_response = weather_api.get_uv_index(lat, lon, priority=priority)
+        return uvi_response.get('value')
+    except (KeyError, requests.exceptions.RequestException):
+        # Fail silently if UV Index data is not available
+        return None
+
+def _classify_aqi(pollution_response):
+    """Builds the AQI block from an air pollution response."""
+    # Get main AQI
+    aqi_value = pollution_response['list'][0]['main']['aqi']
+
+    # Get PM2.5 value and its classification
+    pm25_value = pollution_response['list'][0]['components'].get('pm2_5')
+    pm25_info = get_pm25_info(pm25_value)
+
+    return {
+        "value": aqi_value,
+        "info": get_aqi_info(aqi_value),
+        "pm25": {
+            "value": pm25_value,
+            "info": pm25_info
+        }
+    }
+
+def _fetch_aqi(lat, lon, priority=governor.ENRICH):
+    """Fetches and classifies air pollution data, or None if it is not available."""
+    try:
+        return _classify_aqi(weather_api.get_air_pollution(lat, lon, priority=priority))
+    except (KeyError, IndexError, requests.exceptions.RequestException):
+        # Fail silently if AQI data is not available
+        return None
+
+def _fetch_moon(current, lat, lon):
+    """Calculates moon data for the location in `current`, or None on failure."""
+    try:
+        with metrics.MOON_DURATION.time():
+            return moon_phase.get_moon_phase_data(current['name'], lat, lon, current['timezone'])
+    except Exception:
+        # Fail silently if moon data is not available
+        return None
+
+async def _fetch_uvi_async(lat, lon, priority=governor.ENRICH):
+    """Async variant of _fetch_uvi()."""
+    try:
+        uvi_response = await weather_api.get_uv_index_async(lat, lon, priority=priority)
+        return uvi_response.get('value')
+    except (KeyError, requests.exceptions.RequestException):
+        return None
+
+async def _fetch_aqi_async(lat, lon, priority=governor.ENRICH):
+    """Async variant of _fetch_aqi()."""
+    try:
+        return _classify_aqi(await weather_api.get_air_pollution_async(lat, lon, priority=priority))
+    except (KeyError, IndexError, requests.exceptions.RequestException):
+        return None
+
+# Optional parts fetched from coordinates: name -> (fetch, async fetch)
+_ENRICHERS = {
+    'uvi': (_fetch_uvi, _fetch_uvi_async),
+    'aqi': (_fetch_aqi, _fetch_aqi_async),
+}
+
+class _Deferred:
+    """A call made by the first thread that asks for its result, instead of on the pool."""
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def result(self):
+        return self.fn(*self.args)
+
+    def cancel(self):
+        return False
+
+def _discard_result(task):
+    # Retrieve the outcome of abandoned tasks so asyncio doesn't warn about it
+    if not task.cancelled():
+        task.exception()
+
+# Async lookups still read and write the cache, history and moon data with
+# blocking calls (disk, sqlite, file locks). They run on this pool so they
+# don't stall the event loop.
+_blocking_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='weather-blocking')
+
+async def _off_loop(fn, *args):
+    """Runs a blocking call on the blocking pool, inside the caller's app context."""
+    app = current_app._get_current_object()
+
+    def call():
+        with app.app_context():
+            return fn(*args)
+
+    return await asyncio.get_running_loop().run_in_executor(_blocking_executor, call)
+# --- End Concurrent fetching ---
+
+def _store_data(cache_key, data):
+    """Saves fresh data to the cache, pushes it to live subscribers of the key and records it in the history."""
+    if cache_key is None:
+        raise ValueError("Cannot store weather data without a cache key")
+    cache.set_cache_data(cache_key, data)
+    pubsub.publish(cache_key, data)
+    history.record(cache_key, data)
+
+def _build_forecast(forecast):
+    """Projects the forecast and attaches its daily and next-hours rollups."""
+    projected = projection.project_forecast(forecast)
+    projected.update(forecast_aggregation.aggregate_forecast(projected))
+    return projected
+
+# --- Per-component refresh ---
+# The parts of a weather entry change at different rates, so each one carries
+# its own expiry in data["expires"]. A refresh refetches only the expired parts
+# and keeps the rest. Entries written before this have no expiries and are
+# refetched in full.
+COMPONENTS = ('current', 'forecast', 'aqi', 'uvi', 'moon')
+
+def _component_ttls():
+    config = current_app.config
+    return {
+        'current': config.get('CURRENT_TTL', config.get('CACHE_SOFT_TTL', 600)),
+        'forecast': config.get('FORECAST_TTL', 3600),
+        'aqi': config.get('AQI_TTL', 3600),
+        'uvi': config.get('UVI_TTL', 3 * 3600),
+        'moon': config.get('MOON_TTL', 24 * 3600),
+    }
+
+def _plan_bundle(cache_key, lat, lon, force):
     """
-    Gets weather data, using a cache if available.
-    For MVP, it directly calls the API.
+    Works out which parts of the entry under cache_key need refetching (current
+    conditions too if force is set). Returns (previous data, expiries, due parts,
+    lat, lon), taking the coordinates from the previous entry if not given.
     """
-    cache_key = cache.get_cache_key(city=city)
-    cached_data = cache.get_cache_data(cache_key)
-    if cached_data:
-        print(f"Serving from cache for city: {city}") # For debugging
-        return cached_data
+    now = time.time()
+    previous = cache.get_last_known(cache_key) or {}
+    expires = dict(previous.get('expires') or {})
+    due = {name for name in COMPONENTS if name not in previous or expires.get(name, 0) <= now}
+    if force:
+        due.add('current')
+    if lat is None and previous.get('current'):
+        # A known city: reuse its coordinates so UV/AQI don't wait on current weather
+        coord = previous['current'].get('coord', {})
+        lat, lon = coord.get('lat'), coord.get('lon')
+    return previous, expires, due, lat, lon
 
-    print(f"Fetching from API for city: {city}") # For debugging
-    try:
-        current = weather_api.get_current_weather(city)
-        forecast = weather_api.get_forecast(city)
-        
-        # lat = current['coord']['lat']
-        # lon = current['coord']['lon']
-        coord = current.get('coord', {})
-        lat = coord.get('lat')
-        lon = coord.get('lon') 
-        
-        # --- Moon Phase Integration ---
-        moon_data = None
-        try:
-            moon_data = moon_phase.get_moon_phase_data(current['name'], lat, lon, current['timezone'])
-        except Exception:
-            moon_data = None # Fail silently if moon data is not available
-        # --- End Moon Phase Integration ---
-        
-        # # --- DEBUGGING: PRINT THE RAW API RESPONSE ---
-        # print("--- RAW API RESPONSE FOR CURRENT WEATHER ---")
-        # import json
-        # print(json.dumps(current, indent=2)) # Pretty-print the JSON
-        # print("--------------------------------------------")
-        # # --- END DEBUGGING ---
-
-        # # --- UV Index Integration ---
-        # uvi = current.get('uvi')
-        # print(f"--- Extracted UVI: {uvi} ---") # Also print what we extracted
-        # # --- End UV Index Integration ---
-        
-        
-        # --- UV Index Integration ---
-        uvi = None
+def _assemble_bundle(previous, expires, current, results):
+    """
+    Merges freshly fetched parts into the previous entry. `current` is the
+    projected current weather (new if "current" was due); `results` maps the
+    other refetched parts to their value, None if an optional part failed, or
+    the RequestException a forecast fetch raised. Optional parts that failed
+    keep their previous value and are retried after FAILURE_CACHE_TTL.
+    """
+    now = time.time()
+    ttls = _component_ttls()
+    failure_ttl = current_app.config.get('FAILURE_CACHE_TTL', 30)
+
+    data = {name: previous.get(name) for name in COMPONENTS}
+    if current is not previous.get('current'):
+        expires['current'] = now + ttls['current']
+    data['current'] = current
+    if 'forecast' in results:
+        forecast = results['forecast']
+        if isinstance(forecast, requests.exceptions.RequestException):
+            if not previous.get('forecast'):
+                raise forecast
+            # Keep the previous forecast and try again soon
+            expires['forecast'] = now + failure_ttl
+        else:
+            data['forecast'] = _build_forecast(forecast)
+            expires['forecast'] = now + ttls['forecast']
+    for name in ('uvi', 'aqi', 'moon'):
+        if name not in results:
+            continue
+        if results[name] is None:
+            expires[name] = now + failure_ttl
+        else:
+            data[name] = results[name]
+            expires[name] = now + ttls[name]
+    if results.get('moon') is not None:
+        # Moon data is per local day, so it also expires at the location's midnight
+        offset = current.get('timezone', 0)
+        next_midnight = ((now + offset) // 86400 + 1) * 86400 - offset
+        expires['moon'] = min(expires['moon'], next_midnight)
+
+    data.update({
+        "error": None,
+        "expires": expires,
+        # When this snapshot was stored; drives ETag/Last-Modified on the JSON endpoints
+        "updated_at": now,
+    })
+    return data
+
+def _remember_failure(cache_key, data, ttl_key, default_ttl):
+    """Keeps an error response for a short time so repeats don't go upstream."""
+    cache.set_negative(cache_key, data, current_app.config.get(ttl_key, default_ttl))
+    return data
+# --- End Per-component refresh ---
+
+# --- Locations ---
+class _CityLocation:
+    """A city looked up by name. Its coordinates come from the previous entry, if any."""
+    kind = 'city'
+
+    def __init__(self, city):
+        self.city = city
+        self.cache_key = cache.get_cache_key(city=city)
+        self.lat = self.lon = None
+        self.log_fields = {'city': city}
+
+    def fetch_current(self, priority):
+        return weather_api.get_current_weather(self.city, priority=priority)
+
+    def fetch_forecast(self, priority):
+        return weather_api.get_forecast(self.city, priority=priority)
+
+    async def fetch_current_async(self, priority):
+        return await weather_api.get_current_weather_async(self.city, priority=priority)
+
+    async def fetch_forecast_async(self, priority):
+        return await weather_api.get_forecast_async(self.city, priority=priority)
+
+    def find_nearby(self):
+        return None
+
+    def remember(self, data):
+        """Indexes the entry so nearby geolocation requests can reuse it."""
+        coord = (data.get('current') or {}).get('coord', {})
+        geo_index.add(self.cache_key, coord.get('lat'), coord.get('lon'))
+
+    def failed(self, error):
+        """Returns what to serve when fetching failed: the last known data, or a remembered error."""
+        if isinstance(error, requests.exceptions.HTTPError):
+            if error.response.status_code == 404:
+                return _remember_failure(
+                    self.cache_key,
+                    {"error": f"City '{self.city}' not found. Please try a major city in Bangladesh."},
+                    'NEGATIVE_CACHE_TTL', 300)
+            message = "Could not fetch weather data. Please try again later."
+        else:
+            message = "A network error occurred. Please check your connection."
+        return cache.get_last_known(self.cache_key) or _remember_failure(
+            self.cache_key, {"error": message}, 'FAILURE_CACHE_TTL', 30)
+
+class _CoordsLocation:
+    """A point snapped to the cache grid, so nearby users share one entry (and one fetch)."""
+    kind = 'coords'
+
+    def __init__(self, lat, lon):
+        self.lat, self.lon = lat, lon
+        self.cache_key = cache.get_cache_key(lat=lat, lon=lon)
+        self.log_fields = {'lat': lat, 'lon': lon}
+
+    def fetch_current(self, priority):
+        return weather_api.get_weather_by_coords(self.lat, self.lon, priority=priority)
+
+    def fetch_forecast(self, priority):
+        return weather_api.get_forecast_by_coords(self.lat, self.lon, priority=priority)
+
+    async def fetch_current_async(self, priority):
+        return await weather_api.get_weather_by_coords_async(self.lat, self.lon, priority=priority)
+
+    async def fetch_forecast_async(self, priority):
+        return await weather_api.get_forecast_by_coords_async(self.lat, self.lon, priority=priority)
+
+    def find_nearby(self):
+        return _get_nearby_data(self.lat, self.lon)
+
+    def remember(self, data):
+        geo_index.add(self.cache_key, self.lat, self.lon)
+
+    def failed(self, error):
+        return cache.get_last_known(self.cache_key) or _remember_failure(
+            self.cache_key, {"error": "Could not fetch weather for your location. Please try searching manually."},
+            'FAILURE_CACHE_TTL', 30)
+
+def resolve_location(query):
+    """
+    Turns a lookup request ({"city": ...} or {"lat": ..., "lon": ...}) into a
+    location. Raises ValueError with a message for the user if it is invalid.
+    """
+    city = str(query.get('city') or '').strip()
+    if city:
+        return _CityLocation(city)
+    if query.get('lat') is not None and query.get('lon') is not None:
+        snapped = cache.snap_coords(query['lat'], query['lon'])
+        if snapped is None:
+            raise ValueError("Invalid location coordinates.")
+        return _CoordsLocation(*snapped)
+    raise ValueError("Provide a city or valid lat/lon.")
+
+def _get_nearby_data(lat, lon):
+    """Returns fresh cached data for the nearest indexed location, if one is close enough."""
+    radius_km = current_app.config.get('COORD_REUSE_RADIUS_KM', 0)
+    if not radius_km:
+        return None
+    for nearby_key in geo_index.find_nearby(lat, lon, radius_km):
+        cached_data = cache.get_cache_data(nearby_key)
+        if cached_data:
+            return cached_data
+        if cache.get_cache_age(nearby_key) is None:
+            # The entry is gone for good; stop considering it
+            geo_index.remove(nearby_key)
+    return None
+# --- End Locations ---
+
+# --- Lookup pipeline ---
+# Every weather lookup (page, JSON, batch, stream, prefetch, async) runs these
+# stages: resolve -> lookup (cache) -> fetch -> enrich -> project -> store.
+# Stages from fetch on run once per cache key under single-flight. Upstream
+# calls are started as early as their inputs are known and joined by the first
+# stage that needs them, so a miss still costs roughly the slowest two calls.
+class _LookupContext(pipeline.Context):
+    def __init__(self, query=None, location=None, priority=governor.USER, force=False, is_async=False):
+        super().__init__()
+        self.query = query
+        self.location = location
+        self.priority = priority
+        self.force = force
+        self.is_async = is_async
+        # Filled in by the fetch stage
+        self.started = None
+        self.previous = self.expires = self.due = None
+        self.lat = self.lon = None
+        self.current = None  # Projected current conditions, once known
+        self.pending = {}  # Part name -> Future (or asyncio Task) still in flight
+        self.results = {}  # Part name -> value, None or the RequestException raised
+
+    @property
+    def cache_key(self):
+        return self.location.cache_key
+
+    def start(self, name, fetch, fetch_async, *args, deferred=False):
+        """
+        Starts fetching a part on the fetch pool, or as a task on the event loop.
+        A deferred part is instead fetched by the request thread when a stage
+        first needs it, saving a pool slot for a call that thread would only wait on.
+        """
+        if self.is_async:
+            self.pending[name] = asyncio.ensure_future(fetch_async(*args))
+        elif deferred:
+            self.pending[name] = _Deferred(fetch, *args)
+        else:
+            self.pending[name] = _executor.submit(fetch, *args)
+
+    def cancel_pending(self):
+        """Cancels parts nobody will collect, e.g. after the current conditions failed."""
+        for future in self.pending.values():
+            future.cancel()
+            if self.is_async:
+                future.add_done_callback(_discard_result)
+        self.pending.clear()
+
+class _Resolve(pipeline.Stage):
+    """Turns the request into a location and its cache key."""
+    name = 'resolve'
+
+    def run(self, ctx):
+        if ctx.location is not None:
+            return
         try:
-            # Get coordinates from the current weather response
-            # lat = current['coord']['lat']
-            # lon = current['coord']['lon']
-            uvi_response = weather_api.get_uv_index(lat, lon)
-            uvi = uvi_response.get('value')
-        except (KeyError, requests.exceptions.RequestException):
-            # Fail silently if UV Index data is not available
-            pass
-        # --- End UV Index Integration ---
-        
-        # --- AQI Integration ---
-        aqi_data = None
+            ctx.location = resolve_location(ctx.query)
+        except ValueError as e:
+            ctx.finish({"error": str(e)})
+
+class _Lookup(pipeline.Stage):
+    """Serves the cached entry, refreshing it in the background if stale, or a fresh one close by."""
+    name = 'lookup'
+
+    def run(self, ctx):
+        if ctx.force:
+            return
+        location = ctx.location
+        cached = cache.get_cache_entry(location.cache_key)
+        if cached:
+            cached_data, is_stale = cached
+            if is_stale:
+                # Serve the stale copy now and refresh it for the next request
+                _refresh_in_background(location)
+            # Entries loaded from disk after a restart become reusable by nearby geolocation requests
+            location.remember(cached_data)
+            logger.debug("Serving from cache", extra=dict(location.log_fields, stale=is_stale))
+            return ctx.finish(cached_data)
+
+        # Any fresh entry close enough (a city or another grid cell) will do
+        nearby_data = location.find_nearby()
+        if nearby_data:
+            logger.debug("Serving nearby cache entry", extra=location.log_fields)
+            ctx.finish(nearby_data)
+
+    async def run_async(self, ctx):
+        await _off_loop(self.run, ctx)
+
+class _Fetch(pipeline.Stage):
+    """
+    Works out which parts of the entry expired and starts fetching the current
+    conditions and forecast. Serves an entry another request stored while we
+    waited to lead, or a remembered failure, instead.
+    """
+    name = 'fetch'
+
+    def _plan(self, ctx):
+        """Works out which parts are due. Returns False if a cached entry or failure finished the context."""
+        cached_data = None if ctx.force else cache.get_cache_data(ctx.cache_key)
+        if cached_data:
+            ctx.finish(cached_data)
+            return False
+        failure = cache.get_negative(ctx.cache_key)
+        if failure:
+            ctx.finish(failure)
+            return False
+
+        logger.info("Fetching from API", extra=ctx.location.log_fields)
+        ctx.started = time.perf_counter()
+        ctx.previous, ctx.expires, ctx.due, ctx.lat, ctx.lon = _plan_bundle(
+            ctx.cache_key, ctx.location.lat, ctx.location.lon, ctx.force)
+        ctx.current = ctx.previous.get('current')
+        return True
+
+    def _start(self, ctx):
+        if 'forecast' in ctx.due:
+            ctx.start('forecast', ctx.location.fetch_forecast, ctx.location.fetch_forecast_async, ctx.priority)
+        if 'current' in ctx.due and ctx.lat is not None:
+            # Coordinates are known, so enrichment needn't wait for the current conditions
+            ctx.start('current', ctx.location.fetch_current, ctx.location.fetch_current_async, ctx.priority,
+                      deferred=True)
+
+    def run(self, ctx):
+        if not self._plan(ctx):
+            return
+        self._start(ctx)
+        if 'current' in ctx.due and ctx.lat is None:
+            # Stored in the compact view-model schema, not as the raw OWM payload
+            ctx.current = projection.project_current(ctx.location.fetch_current(ctx.priority))
+
+    async def run_async(self, ctx):
+        if not await _off_loop(self._plan, ctx):
+            return
+        # Tasks must be created on the loop, so the fetches start here
+        self._start(ctx)
+        if 'current' in ctx.due and ctx.lat is None:
+            ctx.current = projection.project_current(await ctx.location.fetch_current_async(ctx.priority))
+
+class _Enrich(pipeline.Stage):
+    """Starts the optional UV and AQI fetches and computes moon data."""
+    name = 'enrich'
+
+    def _start(self, ctx):
+        if ctx.lat is None:
+            coord = ctx.current.get('coord', {})
+            ctx.lat, ctx.lon = coord.get('lat'), coord.get('lon')
+        # UV and AQI are optional, so they never outrank the core calls
+        priority = max(ctx.priority, governor.ENRICH)
+        for name, (fetch, fetch_async) in _ENRICHERS.items():
+            if name in ctx.due:
+                ctx.start(name, fetch, fetch_async, ctx.lat, ctx.lon, priority)
+
+    def run(self, ctx):
+        self._start(ctx)
+        if 'moon' in ctx.due:
+            if 'current' in ctx.pending:
+                ctx.current = projection.project_current(ctx.pending.pop('current').result())
+            ctx.results['moon'] = _fetch_moon(ctx.current, ctx.lat, ctx.lon)
+
+    async def run_async(self, ctx):
+        self._start(ctx)
+        if 'moon' in ctx.due:
+            if 'current' in ctx.pending:
+                ctx.current = projection.project_current(await ctx.pending.pop('current'))
+            ctx.results['moon'] = await _off_loop(_fetch_moon, ctx.current, ctx.lat, ctx.lon)
+
+class _Project(pipeline.Stage):
+    """Collects the parts still in flight and merges them into the compact cached entry."""
+    name = 'project'
+
+    def run(self, ctx):
+        if 'current' in ctx.pending:
+            ctx.current = projection.project_current(ctx.pending.pop('current').result())
+        for name, future in ctx.pending.items():
+            try:
+                ctx.results[name] = future.result()
+            except requests.exceptions.RequestException as e:
+                ctx.results[name] = e
+        ctx.pending.clear()
+        ctx.data = _assemble_bundle(ctx.previous, ctx.expires, ctx.current, ctx.results)
+
+    async def run_async(self, ctx):
+        if 'current' in ctx.pending:
+            ctx.current = projection.project_current(await ctx.pending.pop('current'))
+        for name, task in ctx.pending.items():
+            try:
+                ctx.results[name] = await task
+            except requests.exceptions.RequestException as e:
+                ctx.results[name] = e
+        ctx.pending.clear()
+        ctx.data = _assemble_bundle(ctx.previous, ctx.expires, ctx.current, ctx.results)
+
+class _Store(pipeline.Stage):
+    """Caches the new entry, pushes it to live subscribers and indexes its location."""
+    name = 'store'
+
+    def run(self, ctx):
+        metrics.FETCH_DURATION.observe(time.perf_counter() - ctx.started, kind=ctx.location.kind)
+        _store_data(ctx.cache_key, ctx.data)
+        ctx.location.remember(ctx.data)
+        logger.debug("Stored fresh data", extra=dict(
+            ctx.location.log_fields, stages={name: round(t, 4) for name, t in ctx.timings.items()}))
+
+    async def run_async(self, ctx):
+        await _off_loop(self.run, ctx)
+
+# Other modules may insert, replace or remove stages (see pipeline.Pipeline)
+WEATHER_PIPELINE = pipeline.Pipeline('weather', [_Resolve(), _Lookup(), _Fetch(), _Enrich(), _Project(), _Store()])
+
+# The stage from which work is shared by concurrent lookups of the same key
+_COALESCE_FROM = 'fetch'
+
+def _lock_dir():
+    """Returns the directory for cross-worker fetch locks, or None if disabled."""
+    if current_app.config.get('SINGLEFLIGHT_FILE_LOCK', False):
+        return cache.CACHE_DIR
+    return None
+
+def _run(ctx):
+    """Runs a lookup through the pipeline; concurrent misses for the same key share a single fetch."""
+    WEATHER_PIPELINE.run(ctx, stop=_COALESCE_FROM)
+    if ctx.done:
+        return ctx.data
+    return singleflight.do(ctx.cache_key, lambda: _fill(ctx), _lock_dir())
+
+def _fill(ctx):
+    """
+    Runs the fetching stages (once per in-flight key). If the upstream fails or
+    the call governor refuses, the location decides what to serve instead.
+    """
+    try:
+        WEATHER_PIPELINE.run(ctx, start=_COALESCE_FROM)
+    except requests.exceptions.RequestException as e:
+        return ctx.location.failed(e)
+    finally:
+        ctx.cancel_pending()
+    return ctx.data
+
+async def _run_async(ctx):
+    """Async variant of _run(). Must run inside an app context."""
+    await WEATHER_PIPELINE.run_async(ctx, stop=_COALESCE_FROM)
+    if ctx.done:
+        return ctx.data
+    return await singleflight.do_async(ctx.cache_key, lambda: _fill_async(ctx))
+
+async def _fill_async(ctx):
+    try:
+        await WEATHER_PIPELINE.run_async(ctx, start=_COALESCE_FROM)
+    except requests.exceptions.RequestException as e:
+        return await _off_loop(ctx.location.failed, e)
+    finally:
+        ctx.cancel_pending()
+    return ctx.data
+# --- End Lookup pipeline ---
+
+# --- Background refresh ---
+# Refreshes get their own small pool: they wait on fan-out tasks, so running
+# them on the fan-out pool could starve it.
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='weather-refresh')
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _refresh_in_background(location):
+    """
+    Refetches a stale location's expired parts in the background, at most once at a time.
+    A stale copy is already being served, so the refresh yields to user-facing misses.
+    """
+    cache_key = location.cache_key
+    with _refreshing_lock:
+        if cache_key in _refreshing:
+            return
+        _refreshing.add(cache_key)
+
+    app = current_app._get_current_object()
+    lock_dir = _lock_dir()
+
+    def refresh():
         try:
-            # Get coordinates from the current weather response
-            # lat = current['coord']['lat']
-            # lon = current['coord']['lon']
-            pollution_response = weather_api.get_air_pollution(lat, lon)
-            
-            # Get main AQI
-            aqi_value = pollution_response['list'][0]['main']['aqi']
-            
-            # Get PM2.5 value and its classification
-            pm25_value = pollution_response['list'][0]['components'].get('pm2_5')
-            pm25_info = get_pm25_info(pm25_value)
-            
-            aqi_data = {
-                "value": aqi_value,
-                "info": get_aqi_info(aqi_value),
-                "pm25": {
-                    "value": pm25_value,
-                    "info": pm25_info
-                }
-            }
-            
-        except (KeyError, IndexError, requests.exceptions.RequestException):
-            aqi_data = None # Fail silently if AQI data is not available
-        # --- End AQI Integration ---
-        
-        data = {
-            "current": current,
-            "forecast": forecast,
-            "aqi": aqi_data,
-            "uvi": uvi,
-            "moon": moon_data,
-            "error": None
-        }
-        # Save the fresh data to the cache
-        cache.set_cache_data(cache_key, data)
-        return data
-    
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            return {"error": f"City '{city}' not found. Please try a major city in Bangladesh."}
-        return {"error": "Could not fetch weather data. Please try again later."}
-    
-    except requests.exceptions.RequestException:
-        return {"error": "A network error occurred. Please check your connection."}
-    
+            with app.app_context():
+                ctx = _LookupContext(location=location, priority=governor.ENRICH)
+                singleflight.do(cache_key, lambda: _fill(ctx), lock_dir)
+        except Exception as e:
+            # The stale entry stays in place; the next request will try again
+            logger.warning("Background refresh failed", extra={'cache_key': cache_key, 'error': str(e)})
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(cache_key)
+
+    _refresh_executor.submit(refresh)
+# --- End Background refresh ---
+
+def get_weather(query, priority=governor.USER):
+    """
+    Gets weather for a lookup request ({"city": ...} or {"lat": ..., "lon": ...}),
+    using the cache if available. On a miss, the upstream calls are made concurrently.
+    """
+    return _run(_LookupContext(query=query, priority=priority))
+
+def get_weather_at(location, priority=governor.USER):
+    """Like get_weather(), for a location from resolve_location()."""
+    return _run(_LookupContext(location=location, priority=priority))
+
+def get_weather_data(city):
+    """Gets weather data for a city, using a cache if available."""
+    return get_weather({'city': city})
+
 def get_weather_by_coords(lat, lon):
     """Gets weather data for given coordinates."""
-    cache_key = cache.get_cache_key(lat=lat, lon=lon)
-    cached_data = cache.get_cache_data(cache_key)
-    if cached_data:
-        print(f"Serving from cache for coords: {lat}, {lon}") # For debugging
-        return cached_data
+    return get_weather({'lat': lat, 'lon': lon})
 
-    print(f"Fetching from API for coords: {lat}, {lon}") # For debugging
-    try:
-        current = weather_api.get_weather_by_coords(lat, lon)
-        forecast = weather_api.get_forecast_by_coords(lat, lon)
-        
-        # --- Moon Phase Integration ---
-        moon_data = None
+def refresh_weather_data(city, priority=governor.PREFETCH):
+    """Fetches fresh weather data for a city even if the cached copy is still fresh."""
+    return _run(_LookupContext(location=_CityLocation(city), priority=priority, force=True))
+
+async def get_weather_data_async(city):
+    """Async variant of get_weather_data() for an event loop (see app/asgi.py). Needs an app context."""
+    return await _run_async(_LookupContext(query={'city': city}, is_async=True))
+
+async def get_weather_by_coords_async(lat, lon):
+    """Async variant of get_weather_by_coords(). Needs an app context."""
+    return await _run_async(_LookupContext(query={'lat': lat, 'lon': lon}, is_async=True))
+
+def refresh_weather_group(cities):
+    """
+    Refreshes current conditions for many cached cities with OWM group calls
+    (20 cities per request). Only cities that already have a cache entry with
+    an OWM city ID, and whose other parts (forecast, UV, AQI, moon) haven't
+    expired, qualify; those parts are kept as they are. Returns the cities
+    that were refreshed.
+    """
+    now = time.time()
+    entries = {}  # OWM city ID -> (city, cache_key, cached data)
+    for city in cities:
+        cache_key = cache.get_cache_key(city=city)
+        cached = cache.get_cache_entry(cache_key)
+        if not cached:
+            continue
+        cached_data = cached[0]
+        city_id = (cached_data.get('current') or {}).get('id')
+        expires = cached_data.get('expires') or {}
+        if city_id and all(expires.get(name, 0) > now for name in COMPONENTS if name != 'current'):
+            entries[city_id] = (city, cache_key, cached_data)
+
+    refreshed = []
+    city_ids = list(entries)
+    for i in range(0, len(city_ids), weather_api.GROUP_MAX_IDS):
         try:
-            moon_data = moon_phase.get_moon_phase_data(current['name'], lat, lon, current['timezone'])
-        except Exception:
-            moon_data = None
-        # --- End Moon Phase Integration ---
-        
-        # --- UV Index Integration ---
-        uvi = None
+            response = weather_api.get_current_weather_group(city_ids[i:i + weather_api.GROUP_MAX_IDS])
+        except requests.exceptions.RequestException as e:
+            logger.warning("Group refresh failed", extra={'error': str(e)})
+            continue
+        # Split the group response back into per-city cache entries
+        for current in response.get('list', []):
+            if current.get('id') not in entries:
+                continue
+            city, cache_key, cached_data = entries[current['id']]
+            # The group endpoint reports the timezone under "sys"
+            if 'timezone' not in current:
+                current['timezone'] = current.get('sys', {}).get('timezone', cached_data['current'].get('timezone'))
+            current = projection.project_current(current)
+            expires = dict(cached_data['expires'], current=time.time() + _component_ttls()['current'])
+            _store_data(cache_key, dict(cached_data, current=current, expires=expires, updated_at=time.time()))
+            refreshed.append(city)
+    return refreshed
+
+# --- Batch lookups ---
+# Misses in a batch are fetched on their own bounded pool; each of those
+# fetches fans out on the main fetch pool, so sharing it could deadlock.
+_batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='weather-batch')
+
+def get_weather_batch(items):
+    """
+    Gets weather data for many locations in one pass.
+    Each item is {"city": ...} or {"lat": ..., "lon": ...}. Duplicate locations
+    are looked up once, cache hits are served directly and misses are fetched
+    concurrently. Returns one {"request", "data"} or {"request", "error"} per item.
+    """
+    results = [None] * len(items)
+    lookups = {}  # cache_key -> (location, [item indexes])
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {"request": item, "error": "Each item needs a city or lat/lon."}
+            continue
         try:
-            uvi_response = weather_api.get_uv_index(lat, lon)
-            uvi = uvi_response.get('value')
-        except (KeyError, requests.exceptions.RequestException):
-            pass
-        # --- End UV Index Integration ---
-        
-        # --- AQI Integration ---
-        aqi_data = None
+            location = resolve_location(item)
+        except ValueError:
+            results[i] = {"request": item, "error": "Each item needs a city or valid lat/lon."}
+            continue
+        lookups.setdefault(location.cache_key, (location, []))[1].append(i)
+
+    app = current_app._get_current_object()
+
+    def run(location):
+        with app.app_context():
+            return get_weather_at(location)
+
+    # Hits (fresh or stale) are answered inline, misses go to the pool
+    answers = {}
+    pending = {}
+    for cache_key, (location, _) in lookups.items():
+        if cache.get_cache_age(cache_key) is not None:
+            answers[cache_key] = get_weather_at(location)
+        else:
+            pending[cache_key] = _batch_executor.submit(run, location)
+    for cache_key, future in pending.items():
         try:
-            pollution_response = weather_api.get_air_pollution(lat, lon)
-            
-            # Get main AQI
-            aqi_value = pollution_response['list'][0]['main']['aqi']
-            
-            # Get PM2.5 value and its classification
-            pm25_value = pollution_response['list'][0]['components'].get('pm2_5')
-            pm25_info = get_pm25_info(pm25_value)
-            
-            aqi_data = {
-                "value": aqi_value,
-                "info": get_aqi_info(aqi_value),
-                "pm25": {
-                    "value": pm25_value,
-                    "info": pm25_info
-                }
-            }
-            
-        except (KeyError, IndexError, requests.exceptions.RequestException):
-            aqi_data = None
-        # --- End AQI Integration ---
-
-        data = {
-            "current": current,
-            "forecast": forecast,
-            "aqi": aqi_data,
-            "uvi": uvi,
-            "moon": moon_data,
-            "error": None
-        }
-        # Save the fresh data to the cache
-        cache.set_cache_data(cache_key, data)
-        return data
-    except requests.exceptions.RequestException:
-        return {"error": "Could not fetch weather for your location. Please try searching manually."}
\ No newline at end of file
+            answers[cache_key] = future.result()
+        except Exception:
+            answers[cache_key] = {"error": "Could not fetch weather data. Please try again later."}
+
+    for cache_key, (_, indexes) in lookups.items():
+        data = answers[cache_key]
+        for i in indexes:
+            if data.get('error'):
+                results[i] = {"request": items[i], "error": data['error']}
+            else:
+                results[i] = {"request": items[i], "data": data}
+    return results
+# --- End Batch lookups ---
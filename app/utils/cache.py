@@ -1,53 +1,177 @@
-import json
+import math
 import os
 import time
 from flask import current_app
+from app.utils.cache_backends import FileCacheBackend, create_backend
+from app.utils import metrics
+from app.utils.lru import LRUCache
 
 CACHE_DIR = 'cache'
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+# In-process tier in front of the persistent backend. A hit here needs no
+# I/O and no JSON parsing. Entries are stored as (timestamp, data).
+_memory = LRUCache(max_entries=256)
+
+# Persistent tier shared by all workers (JSON files unless configured otherwise)
+_backend = FileCacheBackend(CACHE_DIR)
+
+# Recent failed lookups (unknown city names, upstream outages with nothing cached)
+# kept briefly so repeats are answered without going upstream. Memory only.
+_negative = LRUCache(max_entries=1024)
+
+# Coordinates are snapped to a grid of this many degrees before they become keys,
+# so nearby users share an entry (0.01 degrees is about 1.1 km)
+_coord_grid = 0.01
+
+def init_app(app):
+    """Sets up the cache backend, the in-memory tier and the coordinate grid from the app config."""
+    global _backend, _coord_grid
+    _backend = create_backend(app.config, CACHE_DIR)
+    _memory.max_entries = app.config.get('CACHE_MEMORY_MAX_ENTRIES', _memory.max_entries)
+    _negative.max_entries = app.config.get('NEGATIVE_CACHE_MAX_ENTRIES', _negative.max_entries)
+    _coord_grid = app.config.get('COORD_GRID_SIZE', _coord_grid)
+
+def snap_coords(lat, lon):
+    """Snaps coordinates to the cache grid. Returns None unless they are a valid latitude and longitude."""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    # Also rules out inf (round() would overflow) and NaN
+    if not (math.isfinite(lat) and math.isfinite(lon) and abs(lat) <= 90 and abs(lon) <= 180):
+        return None
+    # Enough decimals to represent the grid step without float noise
+    decimals = max(0, -math.floor(math.log10(_coord_grid)))
+    return (round(round(lat / _coord_grid) * _coord_grid, decimals),
+            round(round(lon / _coord_grid) * _coord_grid, decimals))
+
 def get_cache_key(lat=None, lon=None, city=None):
     """Generates a unique cache key based on location."""
-    if lat and lon:
-        return f"coords_{lat}_{lon}.json"
+    # 0.0 is a valid coordinate, so only a missing value counts
+    if lat is not None and lon is not None:
+        snapped = snap_coords(lat, lon)
+        if snapped is None:
+            return None
+        return f"coords_{snapped[0]}_{snapped[1]}.json"
     if city:
         # Sanitize city name for file system
         safe_city = "".join(c for c in city if c.isalnum() or c in (' ', '_')).rstrip()
         return f"city_{safe_city}.json"
     return None
 
-def get_cache_data(cache_key):
-    """Retrieves data from cache if it's still valid."""
+def _get_ttls():
+    """Returns the (soft, hard) TTLs in seconds from the app config."""
+    # Entries younger than the soft TTL are fresh. Between the soft and the hard
+    # TTL they are stale but can still be served while a refresh runs.
+    soft_ttl = current_app.config.get('CACHE_SOFT_TTL', current_app.config.get('CACHE_TIMEOUT', 600))
+    hard_ttl = max(current_app.config.get('CACHE_HARD_TTL', soft_ttl), soft_ttl)
+    return soft_ttl, hard_ttl
+
+def get_cache_entry(cache_key):
+    """
+    Retrieves cached data along with its freshness.
+    Returns (data, is_stale), or None if there's no entry within the hard TTL.
+    """
     if not cache_key:
         return None
-    
-    cache_path = os.path.join(CACHE_DIR, cache_key)
-    try:
-        with open(cache_path, 'r') as f:
-            cached_data = json.load(f)
-        
-        # Check if the cache is expired (e.g., 10 minutes)
-        cache_timeout = current_app.config.get('CACHE_TIMEOUT', 600) # 10 minutes default
-        if time.time() - cached_data['timestamp'] < cache_timeout:
-            return cached_data['data']
-    except (FileNotFoundError, json.JSONDecodeError, KeyError):
-        pass
-    
-    return None
+
+    soft_ttl, hard_ttl = _get_ttls()
+
+    # 1. Memory tier (entries drop out of it at the hard TTL)
+    tier = 'memory'
+    entry = _memory.get(cache_key)
+    if entry is not None and time.time() - entry[0] >= soft_ttl:
+        # Stale here, but another worker may have stored a fresher copy since
+        newer = _backend.get(cache_key)
+        if newer is not None and newer[0] > entry[0]:
+            metrics.CACHE_LOOKUPS.inc(tier=tier, result='stale')
+            tier = _backend.name
+            entry = newer
+            _memory.set(cache_key, entry, ttl=hard_ttl - (time.time() - entry[0]))
+
+    # 2. Persistent tier; a usable entry is promoted into memory for its remaining lifetime
+    if entry is None:
+        metrics.CACHE_LOOKUPS.inc(tier=tier, result='miss')
+        tier = _backend.name
+        entry = _backend.get(cache_key)
+        if entry is not None and time.time() - entry[0] < hard_ttl:
+            _memory.set(cache_key, entry, ttl=hard_ttl - (time.time() - entry[0]))
+        else:
+            metrics.CACHE_LOOKUPS.inc(tier=tier, result='miss')
+            return None
+
+    timestamp, data = entry
+    is_stale = time.time() - timestamp >= soft_ttl
+    metrics.CACHE_LOOKUPS.inc(tier=tier, result='stale' if is_stale else 'hit')
+    return data, is_stale
+
+def get_cache_age(cache_key):
+    """Returns the age in seconds of a usable cache entry, or None if there isn't one."""
+    if not cache_key:
+        return None
+    entry = _memory.peek(cache_key)
+    if entry is None:
+        entry = _backend.get(cache_key)
+        if entry is None:
+            return None
+    _, hard_ttl = _get_ttls()
+    age = time.time() - entry[0]
+    return age if age < hard_ttl else None
+
+def get_last_known(cache_key):
+    """
+    Returns the most recent data stored for the key, however old, or None.
+    For when the upstream is unavailable and old data beats an error page.
+    """
+    if not cache_key:
+        return None
+    # Memory drops entries at the hard TTL and may trail another worker's write
+    entries = [entry for entry in (_memory.peek(cache_key), _backend.get_last_known(cache_key)) if entry]
+    return max(entries, key=lambda entry: entry[0])[1] if entries else None
+
+def get_cache_data(cache_key):
+    """Retrieves data from cache if it's still fresh."""
+    entry = get_cache_entry(cache_key)
+    if entry is None or entry[1]:
+        return None
+    return entry[0]
 
 def set_cache_data(cache_key, data):
-    """Saves data to the cache file."""
+    """Saves data to both cache tiers."""
     if not cache_key:
         return
-    
-    cache_path = os.path.join(CACHE_DIR, cache_key)
-    cache_content = {
-        'timestamp': time.time(),
-        'data': data
+
+    timestamp = time.time()
+    _, hard_ttl = _get_ttls()
+    _memory.set(cache_key, (timestamp, data), ttl=hard_ttl)
+    _backend.set(cache_key, timestamp, data, timestamp + hard_ttl)
+
+def get_negative(cache_key):
+    """Returns the remembered failure for the key, or None."""
+    if not cache_key:
+        return None
+    data = _negative.get(cache_key)
+    if data is not None:
+        metrics.CACHE_LOOKUPS.inc(tier='negative', result='hit')
+    return data
+
+def set_negative(cache_key, data, ttl):
+    """Remembers a failed lookup (its error response) for ttl seconds."""
+    if cache_key and ttl:
+        _negative.set(cache_key, data, ttl=ttl)
+
+def get_cache_stats():
+    """
+    Returns the size, hit, miss and eviction counters of the in-process caches.
+    Lookups by tier, the persistent one included, are counted in metrics.CACHE_LOOKUPS.
+    """
+    return {
+        'memory': _memory.stats(),
+        'negative': _negative.stats(),
     }
-    try:
-        with open(cache_path, 'w') as f:
-            json.dump(cache_content, f)
-    except IOError:
-        # Failed to write cache, but we don't want to crash the app
-        pass
\ No newline at end of file
+
+@metrics.collector
+def _collect_metrics():
+    for name, stats in get_cache_stats().items():
+        metrics.observe_lru(name, stats)
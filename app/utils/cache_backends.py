@@ -0,0 +1,186 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+class CacheBackend:
+    """
+    Interface for the persistent cache tier.
+    Entries are stored as (timestamp, data) with an absolute expiry time.
+    """
+    name = 'base'
+
+    def get(self, cache_key):
+        """Returns (timestamp, data) for the key, or None."""
+        raise NotImplementedError
+
+    def get_last_known(self, cache_key):
+        """Returns (timestamp, data) for the key even if it has expired, or None."""
+        return self.get(cache_key)
+
+    def set(self, cache_key, timestamp, data, expires_at):
+        """Stores an entry, replacing any existing one."""
+        raise NotImplementedError
+
+    def delete(self, cache_key):
+        """Removes an entry if present."""
+        raise NotImplementedError
+
+class FileCacheBackend(CacheBackend):
+    """One JSON file per key in a directory (the original cache layout)."""
+    name = 'file'
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, cache_key):
+        cache_path = os.path.join(self.cache_dir, cache_key)
+        try:
+            with open(cache_path, 'r') as f:
+                cached_data = json.load(f)
+            return cached_data['timestamp'], cached_data['data']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def set(self, cache_key, timestamp, data, expires_at):
+        cache_content = {
+            'timestamp': timestamp,
+            'data': data
+        }
+        # Write to a temporary file and rename it into place, so readers in
+        # other workers never see a half-written file
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp_')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(cache_content, f)
+                os.replace(tmp_path, os.path.join(self.cache_dir, cache_key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError):
+            # Failed to write cache, but we don't want to crash the app
+            pass
+
+    def delete(self, cache_key):
+        try:
+            os.remove(os.path.join(self.cache_dir, cache_key))
+        except OSError:
+            pass
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    All entries in one SQLite database in WAL mode.
+    Writes are atomic, readers don't block the writer, and it's safe to share
+    between gunicorn workers. Expired entries are kept for last_known_grace
+    seconds (as a fallback when the upstream fails), then purged, and the table
+    is kept under max_entries, evicting the entries closest to expiry first.
+    """
+    name = 'sqlite'
+
+    # Run the purge/eviction pass once every this many writes
+    PRUNE_EVERY = 50
+
+    def __init__(self, path, max_entries=5000, last_known_grace=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.last_known_grace = last_known_grace
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                timestamp REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_expires_at ON cache_entries (expires_at);
+        """)
+
+    def _connect(self):
+        """Returns this thread's connection (connections can't cross threads or forks)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, cache_key):
+        return self._get(cache_key, time.time())
+
+    def get_last_known(self, cache_key):
+        return self._get(cache_key, float('-inf'))
+
+    def _get(self, cache_key, expires_after):
+        try:
+            row = self._connect().execute(
+                'SELECT timestamp, data FROM cache_entries WHERE key = ? AND expires_at > ?',
+                (cache_key, expires_after)
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        try:
+            return row[0], json.loads(row[1])
+        except ValueError:
+            return None
+
+    def set(self, cache_key, timestamp, data, expires_at):
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO cache_entries (key, timestamp, expires_at, data) VALUES (?, ?, ?, ?)',
+                (cache_key, timestamp, expires_at, json.dumps(data))
+            )
+        except sqlite3.Error:
+            # Failed to write cache, but we don't want to crash the app
+            return
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, cache_key):
+        try:
+            self._connect().execute('DELETE FROM cache_entries WHERE key = ?', (cache_key,))
+        except sqlite3.Error:
+            pass
+
+    def prune(self):
+        """Deletes entries expired for longer than the grace period, then evicts the oldest ones above max_entries."""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_entries WHERE expires_at <= ?', (time.time() - self.last_known_grace,))
+            count = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    'DELETE FROM cache_entries WHERE key IN '
+                    '(SELECT key FROM cache_entries ORDER BY expires_at LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+
+def create_backend(config, cache_dir):
+    """Builds the backend selected by CACHE_BACKEND ('file' or 'sqlite')."""
+    backend = config.get('CACHE_BACKEND', 'file')
+    if backend == 'sqlite':
+        return SQLiteCacheBackend(
+            config.get('CACHE_SQLITE_PATH') or os.path.join(cache_dir, 'cache.db'),
+            max_entries=config.get('CACHE_MAX_ENTRIES', 5000),
+            last_known_grace=config.get('CACHE_LAST_KNOWN_GRACE', 7 * 24 * 3600),
+        )
+    if backend == 'file':
+        return FileCacheBackend(cache_dir)
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
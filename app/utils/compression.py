@@ -0,0 +1,79 @@
+import gzip
+import hashlib
+from flask import request
+from app.utils import metrics
+from app.utils.lru import LRUCache
+
+try:
+    import brotli
+except ImportError:  # Optional; without it responses are gzip-compressed only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript'}
+
+# Compressed bodies keyed by (body digest, encoding). Weather payloads are
+# served from cache over and over, so each distinct body is compressed once.
+_compressed = LRUCache(max_entries=256)
+
+def init_app(app):
+    """Registers response compression on the app."""
+    _compressed.max_entries = app.config.get('COMPRESS_CACHE_MAX_ENTRIES', _compressed.max_entries)
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+    level = app.config.get('COMPRESS_LEVEL', 6)
+
+    @app.after_request
+    def compress_response(response):
+        return _compress(response, min_size, level)
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def _compress(response, min_size, level):
+    """Compresses a response body if the client accepts it and it's worth it."""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+
+    cache_key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+    compressed = _compressed.get(cache_key)
+    if compressed is None:
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=min(level, 11))
+        else:
+            compressed = gzip.compress(body, compresslevel=level, mtime=0)
+        _compressed.set(cache_key, compressed)
+    metrics.COMPRESSION_BYTES.inc(len(body), encoding=encoding, stage='in')
+    metrics.COMPRESSION_BYTES.inc(len(compressed), encoding=encoding, stage='out')
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # The bytes differ from the uncompressed representation, so a strong
+    # validator becomes weak (If-None-Match still uses weak comparison)
+    etag, is_weak = response.get_etag()
+    if etag and not is_weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def get_stats():
+    """Returns counters for the compressed-body cache."""
+    return _compressed.stats()
+
+@metrics.collector
+def _collect_metrics():
+    metrics.observe_lru('compressed', get_stats())
@@ -0,0 +1,99 @@
+import difflib
+import json
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'bd_places.json')
+
+# Spelling variants that show up when Bangla names are written in Latin script.
+# Folding them (and dropping inner vowels) makes Bogra/Bogura, Jessore/Jashore
+# or Barisal/Barishal land on the same key.
+_DIGRAPHS = (('sh', 's'), ('ch', 'c'), ('kh', 'k'), ('gh', 'g'), ('th', 't'),
+             ('dh', 'd'), ('bh', 'b'), ('jh', 'j'), ('ph', 'f'), ('z', 'j'))
+
+_lock = threading.Lock()
+_loaded = False
+# Two sorted arrays of (key, display name): one on the plain lowercase name,
+# one on the folded "sounds like" key. Prefix lookups are a bisect away.
+_names = []
+_folded = []
+_known = set()
+
+def normalize(text):
+    """Lowercases a place name and keeps only letters and single spaces."""
+    return re.sub(r'\s+', ' ', re.sub(r'[^a-z ]', '', text.lower())).strip()
+
+def fold(text):
+    """Reduces a place name to a transliteration-insensitive key."""
+    key = normalize(text).replace(' ', '')
+    for digraph, letter in _DIGRAPHS:
+        key = key.replace(digraph, letter)
+    if not key:
+        return key
+    # Keep the first letter, drop the other vowels, squeeze repeated letters
+    key = key[0] + re.sub(r'[aeiouyw]', '', key[1:])
+    return re.sub(r'(.)\1+', r'\1', key)
+
+def _add_unlocked(name, aliases=()):
+    if name in _known:
+        return
+    _known.add(name)
+    for variant in (name, *aliases):
+        insort(_names, (normalize(variant), name))
+        insort(_folded, (fold(variant), name))
+
+def _load():
+    """Loads the offline place list into the index on first use."""
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        try:
+            with open(DATA_FILE, 'r', encoding='utf-8') as f:
+                places = json.load(f)
+        except (OSError, ValueError):
+            places = []
+        for place in places:
+            _add_unlocked(place['name'], place.get('aliases', []))
+        _loaded = True
+
+def add(name, aliases=()):
+    """Adds a place (e.g. one found by the upstream geocoder) to the index."""
+    _load()
+    with _lock:
+        _add_unlocked(name, aliases)
+
+def _prefix_matches(index, prefix, limit):
+    results = []
+    i = bisect_left(index, (prefix, ''))
+    while i < len(index) and index[i][0].startswith(prefix) and len(results) < limit:
+        if index[i][1] not in results:
+            results.append(index[i][1])
+        i += 1
+    return results
+
+def search(query, limit=5):
+    """
+    Returns up to `limit` place names matching the query.
+    Tries a plain prefix match (names and known aliases), then a
+    transliteration-folded prefix match, then a fuzzy match for typos.
+    """
+    _load()
+    prefix = normalize(query)
+    if not prefix:
+        return []
+
+    with _lock:
+        results = _prefix_matches(_names, prefix, limit)
+        folded = fold(prefix)
+        # Folded keys are short, so only fall back to them when the plain name found nothing
+        if not results and len(folded) >= 3:
+            results = _prefix_matches(_folded, folded, limit)
+        if not results:
+            keys = {key: name for key, name in _names}
+            for key in difflib.get_close_matches(prefix, list(keys), n=limit, cutoff=0.75):
+                if keys[key] not in results:
+                    results.append(keys[key])
+    return results
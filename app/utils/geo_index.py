@@ -0,0 +1,63 @@
+import math
+import threading
+
+# Size of an index cell in degrees (about 11 km at Bangladesh's latitude)
+CELL_SIZE = 0.1
+EARTH_RADIUS_KM = 6371.0
+
+# cell -> {cache_key: (lat, lon)}, plus the reverse map so keys can move or be removed
+_cells = {}
+_locations = {}
+_lock = threading.Lock()
+
+def _cell(lat, lon):
+    return (math.floor(lat / CELL_SIZE), math.floor(lon / CELL_SIZE))
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points (haversine formula)."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def add(cache_key, lat, lon):
+    """Indexes a cache entry at the given location."""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return
+    with _lock:
+        old = _locations.get(cache_key)
+        if old == (lat, lon):
+            return
+        if old is not None:
+            _cells.get(_cell(*old), {}).pop(cache_key, None)
+        _locations[cache_key] = (lat, lon)
+        _cells.setdefault(_cell(lat, lon), {})[cache_key] = (lat, lon)
+
+def remove(cache_key):
+    """Drops a cache entry from the index."""
+    with _lock:
+        old = _locations.pop(cache_key, None)
+        if old is not None:
+            _cells.get(_cell(*old), {}).pop(cache_key, None)
+
+def find_nearby(lat, lon, radius_km):
+    """Returns the indexed cache keys within radius_km, nearest first."""
+    lat, lon = float(lat), float(lon)
+    # How many cells the radius spans in each direction
+    lat_span = math.ceil(radius_km / 111.0 / CELL_SIZE)
+    lon_span = math.ceil(radius_km / (111.0 * max(math.cos(math.radians(lat)), 0.01)) / CELL_SIZE)
+    cell_lat, cell_lon = _cell(lat, lon)
+
+    matches = []
+    with _lock:
+        for i in range(cell_lat - lat_span, cell_lat + lat_span + 1):
+            for j in range(cell_lon - lon_span, cell_lon + lon_span + 1):
+                for cache_key, (key_lat, key_lon) in _cells.get((i, j), {}).items():
+                    distance = distance_km(lat, lon, key_lat, key_lon)
+                    if distance <= radius_km:
+                        matches.append((distance, cache_key))
+    matches.sort()
+    return [cache_key for _, cache_key in matches]
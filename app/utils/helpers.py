@@ -20,4 +20,25 @@ def format_alert_timestamp(ts, timezone_offset):
     """
     utc_dt = datetime.utcfromtimestamp(ts)
     local_dt = utc_dt + timedelta(seconds=timezone_offset)
-    return local_dt.strftime('%I:%M %p, %b %d')
\ No newline at end of file
+    return local_dt.strftime('%I:%M %p, %b %d')
+
+def json_merge_patch(old, new):
+    """
+    Returns the JSON Merge Patch (RFC 7386) that turns `old` into `new`.
+    Changed keys carry their new value, removed keys map to None, and
+    lists are replaced whole. An empty dict means nothing changed.
+    """
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            nested = json_merge_patch(old[key], value)
+            if nested:
+                patch[key] = nested
+        elif value != old[key]:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
@@ -0,0 +1,349 @@
+import array
+import logging
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from app.config import Config
+from app.utils.lru import LRUCache
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; compaction passes aren't coordinated between workers
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Append-only history of the current conditions and air quality per location,
+# for trends ("last 24h temperature") without the paid OWM history API.
+#
+# Each series (one per location) is a directory of UTC day segments:
+#   <day>.log  the day's rows, appended as observations arrive: a uint32 second
+#              offset from midnight plus one float32 per field.
+#   <day>.seg  a sealed day in columnar form: the timestamps as uint32 deltas
+#              (each from the previous row), then one float32 column per field.
+# compact() seals past days' logs into segments, averages days older than
+# HISTORY_RAW_DAYS into HISTORY_DOWNSAMPLE_SECONDS buckets and deletes days
+# past retention. A query opens only the segments of the days it covers, and
+# reads only the columns it asks for. Missing values are stored as NaN.
+
+FIELDS = ('temp', 'feels_like', 'humidity', 'pressure', 'wind_speed', 'uvi', 'aqi', 'pm25')
+
+DAY = 86400
+_LOG_MAGIC = b'SHL1'
+_SEG_MAGIC = b'SHS1'
+# magic, day start, resolution in seconds (0 = raw), row count, field names length
+_HEADER = struct.Struct('<4sIIIH')
+
+# Settings used until init_app() is called with the Flask config.
+_settings = {
+    'enabled': Config.HISTORY_ENABLED,
+    'dir': Config.HISTORY_DIR,
+    'retention_days': Config.HISTORY_RETENTION_DAYS,
+    'raw_days': Config.HISTORY_RAW_DAYS,
+    'downsample_seconds': Config.HISTORY_DOWNSAMPLE_SECONDS,
+    'compact_interval': Config.HISTORY_COMPACT_INTERVAL,
+}
+
+def init_app(app):
+    """Reads the history location, retention and downsampling settings from the app config."""
+    _settings.update({
+        'enabled': app.config.get('HISTORY_ENABLED', _settings['enabled']),
+        'dir': app.config.get('HISTORY_DIR', _settings['dir']),
+        'retention_days': app.config.get('HISTORY_RETENTION_DAYS', _settings['retention_days']),
+        'raw_days': app.config.get('HISTORY_RAW_DAYS', _settings['raw_days']),
+        'downsample_seconds': app.config.get('HISTORY_DOWNSAMPLE_SECONDS', _settings['downsample_seconds']),
+        'compact_interval': app.config.get('HISTORY_COMPACT_INTERVAL', _settings['compact_interval']),
+    })
+
+def series_name(cache_key):
+    """Names the series of a cache entry: "city_Dhaka.json" -> "city_dhaka"."""
+    return os.path.splitext(cache_key)[0].lower()
+
+def _series_dir(series):
+    return os.path.join(_settings['dir'], series)
+
+def _day_path(series, day, suffix):
+    return os.path.join(_series_dir(series), f'{day}{suffix}')
+
+# --- Encoding ---
+def _little_endian(values):
+    """Converts an array to/from the on-disk byte order (little-endian) in place."""
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _header_bytes(magic, day, resolution, count, fields):
+    names = ','.join(fields).encode()
+    return _HEADER.pack(magic, day * DAY, resolution, count, len(names)) + names
+
+def _read_header(f, magic):
+    raw = f.read(_HEADER.size)
+    if len(raw) < _HEADER.size:
+        raise ValueError("truncated header")
+    found, start, resolution, count, names_length = _HEADER.unpack(raw)
+    if found != magic:
+        raise ValueError("not a history file")
+    fields = tuple(f.read(names_length).decode().split(','))
+    return start, resolution, count, fields
+
+def _read_log(path):
+    """Returns (timestamps, {field: values}) from a day log, ignoring a torn last row."""
+    with open(path, 'rb') as f:
+        start, _, _, fields = _read_header(f, _LOG_MAGIC)
+        body = f.read()
+    row = struct.Struct('<I' + 'f' * len(fields))
+    body = body[:len(body) - len(body) % row.size]
+    timestamps, columns = [], {field: [] for field in fields}
+    for offset, *values in row.iter_unpack(body):
+        timestamps.append(start + offset)
+        for field, value in zip(fields, values):
+            columns[field].append(value)
+    return timestamps, columns
+
+def _read_segment(path, wanted=None):
+    """Returns (timestamps, {field: values}, resolution) from a sealed segment, reading only the wanted columns."""
+    with open(path, 'rb') as f:
+        start, resolution, count, fields = _read_header(f, _SEG_MAGIC)
+        deltas = array.array('I')
+        deltas.fromfile(f, count)
+        timestamps = []
+        last = start
+        for delta in _little_endian(deltas):
+            last += delta
+            timestamps.append(last)
+        columns_start = f.tell()
+        columns = {}
+        for i, field in enumerate(fields):
+            if wanted is not None and field not in wanted:
+                continue
+            f.seek(columns_start + i * count * 4)
+            column = array.array('f')
+            column.fromfile(f, count)
+            columns[field] = _little_endian(column).tolist()
+    return timestamps, columns, resolution
+
+def _write_segment(path, day, timestamps, columns, resolution):
+    """Writes a sealed segment atomically (temporary file, then rename)."""
+    deltas = array.array('I', (t - p for t, p in zip(timestamps, [day * DAY] + timestamps[:-1])))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_header_bytes(_SEG_MAGIC, day, resolution, len(timestamps), FIELDS))
+            _little_endian(deltas).tofile(f)
+            for field in FIELDS:
+                _little_endian(array.array('f', columns.get(field) or [math.nan] * len(timestamps))).tofile(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+# --- End Encoding ---
+
+# --- Recording ---
+# Last observation time recorded per series in this process. The store runs
+# again when only the forecast was refreshed, so the same reading comes back.
+_last_recorded = LRUCache(max_entries=4096)
+_last_recorded_lock = threading.Lock()
+
+def _reading(data):
+    """Extracts the recorded fields from a weather entry."""
+    current = data.get('current') or {}
+    main = current.get('main') or {}
+    aqi = data.get('aqi') or {}
+    values = {
+        'temp': main.get('temp'),
+        'feels_like': main.get('feels_like'),
+        'humidity': main.get('humidity'),
+        'pressure': main.get('pressure'),
+        'wind_speed': (current.get('wind') or {}).get('speed'),
+        'uvi': data.get('uvi'),
+        'aqi': aqi.get('value'),
+        'pm25': (aqi.get('pm25') or {}).get('value'),
+    }
+    return [math.nan if values[field] is None else float(values[field]) for field in FIELDS]
+
+def _create_log(path, day):
+    """Creates a day log with its header unless it exists. Linking makes the creation atomic."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_header_bytes(_LOG_MAGIC, day, 0, 0, FIELDS))
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_path)
+
+def record(cache_key, data):
+    """Appends the observation in a freshly fetched weather entry to its location's history."""
+    if not _settings['enabled'] or cache_key is None or data.get('error'):
+        return
+    observed = (data.get('current') or {}).get('dt')
+    if not observed:
+        return
+    series = series_name(cache_key)
+    with _last_recorded_lock:
+        if (_last_recorded.get(series) or 0) >= observed:
+            return
+        _last_recorded.set(series, observed)
+
+    day = observed // DAY
+    path = _day_path(series, day, '.log')
+    row = struct.pack('<I' + 'f' * len(FIELDS), observed - day * DAY, *_reading(data))
+    try:
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _create_log(path, day)
+        # One small write to a file opened for appending, so concurrent workers don't interleave rows
+        with open(path, 'ab') as f:
+            f.write(row)
+    except OSError as e:
+        logger.warning("Could not record history", extra={'series': series, 'error': str(e)})
+    _maybe_compact()
+# --- End Recording ---
+
+# --- Queries ---
+def _read_day(series, day, wanted):
+    """Returns the sorted, de-duplicated (timestamp, {field: value}) rows stored for one day."""
+    rows = {}
+    for suffix in ('.seg', '.log'):
+        path = _day_path(series, day, suffix)
+        try:
+            if suffix == '.seg':
+                timestamps, columns, _ = _read_segment(path, wanted)
+            else:
+                timestamps, columns = _read_log(path)
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, EOFError) as e:
+            logger.warning("Skipping unreadable history file", extra={'path': path, 'error': str(e)})
+            continue
+        for i, timestamp in enumerate(timestamps):
+            # The same reading may have been recorded by two workers
+            rows.setdefault(timestamp, {field: columns[field][i] for field in wanted if field in columns})
+    return sorted(rows.items())
+
+def query(cache_key, start, end, fields=FIELDS, step=None):
+    """
+    Returns the recorded observations for a location between start and end (unix
+    seconds) as {"timestamps": [...], "values": {field: [...]}}, missing values as
+    None. With a step in seconds, observations are averaged into buckets that long.
+    """
+    series = series_name(cache_key)
+    fields = [field for field in fields if field in FIELDS]
+    timestamps, values = [], {field: [] for field in fields}
+    for day in range(int(start) // DAY, int(end) // DAY + 1):
+        for timestamp, row in _read_day(series, day, set(fields)):
+            if start <= timestamp <= end:
+                timestamps.append(timestamp)
+                for field in fields:
+                    values[field].append(row.get(field, math.nan))
+    if step:
+        timestamps, values = _downsample(timestamps, values, step)
+    return {
+        "timestamps": timestamps,
+        "values": {field: [None if math.isnan(v) else round(v, 2) for v in column] for field, column in values.items()},
+    }
+
+def _downsample(timestamps, columns, step):
+    """Averages rows into step-second buckets, labelled by their start. NaNs are left out of the means."""
+    buckets = {}
+    for i, timestamp in enumerate(timestamps):
+        bucket = buckets.setdefault(timestamp - timestamp % step, {field: [] for field in columns})
+        for field, column in columns.items():
+            if not math.isnan(column[i]):
+                bucket[field].append(column[i])
+    starts = sorted(buckets)
+    averaged = {
+        field: [sum(buckets[s][field]) / len(buckets[s][field]) if buckets[s][field] else math.nan for s in starts]
+        for field in columns
+    }
+    return starts, averaged
+# --- End Queries ---
+
+# --- Compaction ---
+_next_compaction = 0.0
+_compaction_lock = threading.Lock()
+
+def _maybe_compact():
+    """Starts a compaction pass in the background at most every HISTORY_COMPACT_INTERVAL seconds."""
+    global _next_compaction
+    with _compaction_lock:
+        if time.time() < _next_compaction:
+            return
+        _next_compaction = time.time() + _settings['compact_interval']
+    threading.Thread(target=compact, name='history-compact', daemon=True).start()
+
+def compact(now=None):
+    """
+    Seals past days' logs into columnar segments, downsamples old segments and
+    deletes expired ones. Returns counts of what was done. Only one worker runs
+    a pass at a time; the others skip it.
+    """
+    stats = {'sealed': 0, 'downsampled': 0, 'deleted': 0}
+    root = _settings['dir']
+    if not os.path.isdir(root):
+        return stats
+    lock_file = open(os.path.join(root, '.compact.lock'), 'w')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return stats
+        today = int(now or time.time()) // DAY
+        for series in os.listdir(root):
+            if os.path.isdir(os.path.join(root, series)):
+                _compact_series(series, today, stats)
+    finally:
+        lock_file.close()
+    if any(stats.values()):
+        logger.info("Compacted history", extra=stats)
+    return stats
+
+def _compact_series(series, today, stats):
+    days = {}
+    for name in os.listdir(_series_dir(series)):
+        day, suffix = os.path.splitext(name)
+        if day.isdigit() and suffix in ('.log', '.seg'):
+            days.setdefault(int(day), set()).add(suffix)
+
+    for day, suffixes in sorted(days.items()):
+        age = today - day
+        try:
+            if age > _settings['retention_days']:
+                for suffix in suffixes:
+                    os.unlink(_day_path(series, day, suffix))
+                stats['deleted'] += 1
+                continue
+            if age < 1:
+                # Today's log is still being appended to
+                continue
+            downsample = age > _settings['raw_days']
+            resolution = None
+            if '.seg' in suffixes:
+                with open(_day_path(series, day, '.seg'), 'rb') as f:
+                    resolution = _read_header(f, _SEG_MAGIC)[1]
+            if '.log' not in suffixes and (not downsample or resolution):
+                continue
+
+            rows = _read_day(series, day, set(FIELDS))
+            timestamps = [timestamp for timestamp, _ in rows]
+            columns = {field: [row.get(field, math.nan) for _, row in rows] for field in FIELDS}
+            new_resolution = resolution or 0
+            if downsample:
+                new_resolution = _settings['downsample_seconds']
+                timestamps, columns = _downsample(timestamps, columns, new_resolution)
+                # A bucket size that doesn't divide a day can start before midnight
+                timestamps = [max(timestamp, day * DAY) for timestamp in timestamps]
+                stats['downsampled'] += 1
+            _write_segment(_day_path(series, day, '.seg'), day, timestamps, columns, new_resolution)
+            if '.log' in suffixes:
+                os.unlink(_day_path(series, day, '.log'))
+                stats['sealed'] += 1
+        except (OSError, ValueError, EOFError) as e:
+            logger.warning("History compaction failed", extra={'series': series, 'day': day, 'error': str(e)})
+# --- End Compaction ---
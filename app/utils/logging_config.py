@@ -0,0 +1,43 @@
+import json
+import logging
+import sys
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, including its `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S%z'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RESERVED})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class KeyValueFormatter(logging.Formatter):
+    """Human-readable lines with the `extra` fields appended as key=value pairs."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(f'{key}={value}' for key, value in vars(record).items() if key not in _RESERVED)
+        return f'{line} {fields}' if fields else line
+
+def init_app(app):
+    """Configures the "app" logger from LOG_LEVEL and LOG_FORMAT ('json' or 'text')."""
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        formatter = JSONFormatter()
+    else:
+        formatter = KeyValueFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(formatter)
+
+    logger = logging.getLogger('app')
+    logger.handlers = [handler]
+    logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    logger.propagate = False
@@ -0,0 +1,217 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, request
+
+# A small in-process registry rendered in the Prometheus text format.
+# Each gunicorn worker keeps its own counters, so scrape every worker (or
+# aggregate by instance) rather than assuming one process.
+
+# Latency buckets in seconds, from a memory-cache hit up to a slow upstream call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+# Functions run before each scrape to copy state other modules keep (cache sizes, ...) into metrics
+_collectors = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _samples(self):
+        """Yields (suffix, label values, extra labels, value) for the exposition."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, values, extra, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.label_names, values, extra)} {value}')
+        return '\n'.join(lines)
+
+class Counter(_Metric):
+    """A value that only goes up (requests served, errors seen)."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Sets the total, for counts kept by another object (e.g. LRUCache.evictions)."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            yield '_total', values, (), value
+
+class Gauge(_Metric):
+    """A value that goes up and down (requests in flight)."""
+    type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Counts the enclosed block as in flight."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            yield '', values, (), value
+
+class Histogram(_Metric):
+    """Observations counted into buckets, plus their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the enclosed block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._values.items())
+        for values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                yield '_bucket', values, (('le', bound),), cumulative
+            yield '_sum', values, (), total
+            yield '_count', values, (), count
+
+def collector(fn):
+    """Registers fn to be called before each scrape (usable as a decorator)."""
+    _collectors.append(fn)
+    return fn
+
+def observe_lru(name, stats):
+    """Copies an in-process cache's LRUCache.stats() into the LRU_* metrics under the given name."""
+    LRU_ENTRIES.set(stats['size'], cache=name)
+    LRU_CAPACITY.set(stats['max_entries'], cache=name)
+    LRU_LOOKUPS.set(stats['hits'], cache=name, result='hit')
+    LRU_LOOKUPS.set(stats['misses'], cache=name, result='miss')
+    LRU_EVICTIONS.set(stats['evictions'], cache=name)
+
+def render():
+    """Returns every registered metric in the Prometheus text exposition format."""
+    for collect in _collectors:
+        collect()
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+# --- Metrics ---
+HTTP_REQUESTS_IN_FLIGHT = Gauge('shamiran_http_requests_in_flight', 'Requests currently being served.')
+HTTP_REQUEST_DURATION = Histogram(
+    'shamiran_http_request_duration_seconds', 'Time to serve a request.', ('endpoint', 'status'))
+
+UPSTREAM_REQUESTS_IN_FLIGHT = Gauge(
+    'shamiran_upstream_requests_in_flight', 'OpenWeatherMap calls currently waiting on a response.')
+UPSTREAM_REQUEST_DURATION = Histogram(
+    'shamiran_upstream_request_duration_seconds', 'Latency of OpenWeatherMap calls.', ('endpoint',))
+UPSTREAM_ERRORS = Counter(
+    'shamiran_upstream_errors', 'Failed OpenWeatherMap calls.', ('endpoint', 'reason'))
+UPSTREAM_REJECTED = Counter(
+    'shamiran_upstream_rejected', 'OpenWeatherMap calls refused by the call governor.', ('endpoint', 'reason'))
+UPSTREAM_CIRCUIT_OPEN = Gauge(
+    'shamiran_upstream_circuit_open', 'Whether the circuit breaker for an endpoint is open (1) or closed (0).',
+    ('endpoint',))
+
+CACHE_LOOKUPS = Counter(
+    'shamiran_cache_lookups', 'Cache lookups by tier and result (hit, miss or stale).', ('tier', 'result'))
+LRU_ENTRIES = Gauge('shamiran_lru_entries', 'Entries held by each in-process LRU cache.', ('cache',))
+LRU_CAPACITY = Gauge('shamiran_lru_capacity', 'Maximum entries of each in-process LRU cache.', ('cache',))
+LRU_LOOKUPS = Counter(
+    'shamiran_lru_lookups', 'Lookups in each in-process LRU cache by result (hit or miss).', ('cache', 'result'))
+LRU_EVICTIONS = Counter(
+    'shamiran_lru_evictions', 'Entries dropped from each in-process LRU cache to make room.', ('cache',))
+
+FETCH_DURATION = Histogram(
+    'shamiran_fetch_duration_seconds', 'Time to fetch and build a full weather bundle on a cache miss.', ('kind',))
+MOON_DURATION = Histogram('shamiran_moon_duration_seconds', 'Time to compute moon data for a location.')
+RENDER_DURATION = Histogram('shamiran_render_duration_seconds', 'Time to produce the index page HTML.', ('cached',))
+STREAM_SUBSCRIBERS = Gauge('shamiran_stream_subscribers', 'Live update subscribers (open weather streams).')
+COMPRESSION_BYTES = Counter(
+    'shamiran_compression_bytes', 'Compressed response bytes before (in) and after (out) compression.',
+    ('encoding', 'stage'))
+PIPELINE_STAGE_DURATION = Histogram(
+    'shamiran_pipeline_stage_duration_seconds', 'Time spent in each stage of a lookup pipeline.', ('pipeline', 'stage'))
+# --- End Metrics ---
+
+def init_app(app):
+    """Tracks in-flight requests and request durations for every endpoint."""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                endpoint=request.endpoint or 'unknown',
+                status=response.status_code,
+            )
+        return response
+
+    @app.teardown_request
+    def end_request(exc):
+        HTTP_REQUESTS_IN_FLIGHT.dec()
@@ -1,6 +1,14 @@
+import logging
+from bisect import bisect_right
 from datetime import datetime, date, timedelta
+from functools import lru_cache
 from astral import moon
-from astral import LocationInfo
+from astral import Observer
+
+logger = logging.getLogger(__name__)
+
+# Days of phase data computed ahead of today; must cover a full lunar cycle
+EPHEMERIS_WINDOW_DAYS = 35
 
 def _get_phase_details(phase_number):
     """A helper function to map a phase number to a name and emoji."""
@@ -21,25 +29,48 @@ def _get_phase_details(phase_number):
     else:
         return "Waning Crescent", "🌘"
 
+@lru_cache(maxsize=4)
+def _get_phase_table(start_date):
+    """
+    Builds the phase ephemeris for a rolling window starting at start_date.
+    Returns the (name, emoji) phase per day and the phase transitions as
+    parallel lists of dates and names.
+    """
+    phases = []
+    transition_dates = []
+    transition_names = []
+    for i in range(EPHEMERIS_WINDOW_DAYS + 1):
+        day = start_date + timedelta(days=i)
+        phase = _get_phase_details(moon.phase(day))
+        if phases and phase[0] != phases[-1][0]:
+            transition_dates.append(day)
+            transition_names.append(phase[0])
+        phases.append(phase)
+    return phases, transition_dates, transition_names
+
+# Keyed on the exact coordinates: callers pass those of a cache entry (already
+# snapped to the cache grid), so repeats hit without changing the result
+@lru_cache(maxsize=512)
+def _get_rise_and_set(day, lat, lon):
+    """Computes moonrise and moonset (UTC) for a day and location."""
+    observer = Observer(latitude=lat, longitude=lon)
+    return moon.moonrise(observer, date=day), moon.moonset(observer, date=day)
+
 def get_moon_phase_data(city_name, lat, lon, timezone_offset):
     """
     Calculates moon phase, moonrise, and moonset for a given location.
+    Results come from per-day, per-location tables, so repeat calls are nearly free.
     """
     try:
-        # Create a location object for the city
-        location = LocationInfo(city_name, "Bangladesh", "Asia/Dhaka", lat, lon)
         today_date = date.today()
+        phases, transition_dates, transition_names = _get_phase_table(today_date)
 
         # 1. Get current phase
-        phase_number = moon.phase(today_date)
-        current_phase_name, current_phase_emoji = _get_phase_details(phase_number)
+        current_phase_name, current_phase_emoji = phases[0]
         phase_class = current_phase_name.lower().replace(' ', '-')
 
-        # 2. Get moonrise and moonset
-        # The observer object is needed for these calculations
-        observer = location.observer
-        rise_time_utc = moon.moonrise(observer, date=today_date)
-        set_time_utc = moon.moonset(observer, date=today_date)
+        # 2. Get moonrise and moonset for the location
+        rise_time_utc, set_time_utc = _get_rise_and_set(today_date, float(lat), float(lon))
 
         # 3. Format times
         def format_time(dt_utc):
@@ -52,16 +83,13 @@ def get_moon_phase_data(city_name, lat, lon, timezone_offset):
         moonrise_formatted = format_time(rise_time_utc)
         moonset_formatted = format_time(set_time_utc)
 
-        # 4. Find next phase
+        # 4. Find next phase with a binary search over the transition dates
         next_phase_date = None
         next_phase_name = None
-        for i in range(1, 31):
-            future_date = today_date + timedelta(days=i)
-            future_phase_name, _ = _get_phase_details(moon.phase(future_date))
-            if future_phase_name != current_phase_name:
-                next_phase_date = future_date
-                next_phase_name = future_phase_name
-                break
+        i = bisect_right(transition_dates, today_date)
+        if i < len(transition_dates):
+            next_phase_date = transition_dates[i]
+            next_phase_name = transition_names[i]
         
         return {
             "moonrise": moonrise_formatted,
@@ -74,5 +102,5 @@ def get_moon_phase_data(city_name, lat, lon, timezone_offset):
         }
 
     except Exception as e:
-        print(f"Error calculating moon phase: {e}")
+        logger.warning("Error calculating moon phase", extra={'error': str(e)})
         return None
\ No newline at end of file
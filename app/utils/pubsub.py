@@ -0,0 +1,49 @@
+import queue
+import threading
+from app.utils import metrics
+
+# cache key -> set of subscriber queues
+_subscribers = {}
+_lock = threading.Lock()
+
+def subscribe(key, maxsize=8):
+    """Returns a queue that receives every message published for the key."""
+    q = queue.Queue(maxsize=maxsize)
+    with _lock:
+        _subscribers.setdefault(key, set()).add(q)
+    return q
+
+def unsubscribe(key, q):
+    """Stops delivering messages for the key to the queue."""
+    with _lock:
+        subscribers = _subscribers.get(key)
+        if subscribers is not None:
+            subscribers.discard(q)
+            if not subscribers:
+                del _subscribers[key]
+
+def publish(key, message):
+    """Delivers a message to every subscriber of the key without blocking."""
+    with _lock:
+        subscribers = list(_subscribers.get(key, ()))
+    for q in subscribers:
+        try:
+            q.put_nowait(message)
+        except queue.Full:
+            # A slow subscriber only needs the latest state; drop its oldest message
+            try:
+                q.get_nowait()
+                q.put_nowait(message)
+            except (queue.Empty, queue.Full):
+                pass
+
+def subscriber_count(key=None):
+    """Returns the number of subscribers for a key, or for all keys."""
+    with _lock:
+        if key is not None:
+            return len(_subscribers.get(key, ()))
+        return sum(len(subscribers) for subscribers in _subscribers.values())
+
+@metrics.collector
+def _collect_metrics():
+    metrics.STREAM_SUBSCRIBERS.set(subscriber_count())
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; fall back to in-process coalescing only
+    fcntl = None
+
+class _Call:
+    """An in-flight call that other threads can wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_calls = {}
+_lock = threading.Lock()
+
+def do(key, fn, lock_dir=None):
+    """
+    Runs fn() once per key at a time and shares its result.
+    Threads that ask for a key while a call for it is in flight wait for that
+    call instead of starting their own. If lock_dir is given, the leader also
+    holds a file lock there so other worker processes queue behind it.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        if lock_dir and fcntl is not None:
+            call.result = _run_with_file_lock(key, fn, lock_dir)
+        else:
+            call.result = fn()
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.done.set()
+    return call.result
+
+def _run_with_file_lock(key, fn, lock_dir):
+    """Runs fn() while holding an exclusive lock file for the key."""
+    lock_path = os.path.join(lock_dir, f".{key}.lock")
+    try:
+        lock_file = open(lock_path, 'a')
+    except OSError:
+        # Can't create the lock file; coalescing within this process still applies
+        return fn()
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            return fn()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# In-flight coroutine calls, keyed by (event loop, key)
+_async_calls = {}
+
+async def do_async(key, fn):
+    """
+    Like do(), for coroutine functions: concurrent awaits of a key on the same
+    event loop share one call of fn(). There is no cross-process lock here;
+    waiting on a file lock would block the loop.
+    """
+    loop = asyncio.get_running_loop()
+    call_key = (loop, key)
+    future = _async_calls.get(call_key)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    future = _async_calls[call_key] = loop.create_future()
+    try:
+        result = await fn()
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        # Mark the exception as retrieved in case nobody else was waiting
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        _async_calls.pop(call_key, None)
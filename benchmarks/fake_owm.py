@@ -0,0 +1,214 @@
+"""
+A local stand-in for the OpenWeatherMap endpoints the app uses, for load
+testing without spending API quota.
+
+Serves /data/2.5/weather, forecast, group, uvi, air_pollution and
+/geo/1.0/direct with plausible, deterministic payloads. Latency and errors
+can be injected:
+
+    python -m benchmarks.fake_owm --port 8001 --latency 0.08 --jitter 0.04 --error-rate 0.01
+
+Then run the app against it:
+
+    OWM_BASE_URL=http://127.0.0.1:8001 API_KEY=fake python run.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Cities answered by name (anything else gets a 404, like the real API)
+KNOWN_CITIES = {
+    'dhaka': (23.7104, 90.4074), 'chittagong': (22.3384, 91.8317), 'khulna': (22.8098, 89.5644),
+    'rajshahi': (24.3740, 88.6011), 'sylhet': (24.8998, 91.8710), 'barisal': (22.7010, 90.3535),
+    'rangpur': (25.7466, 89.2517), 'mymensingh': (24.7564, 90.4065), 'comilla': (23.4619, 91.1850),
+    'gazipur': (24.0023, 90.4264), 'narayanganj': (23.6238, 90.5000), 'bogra': (24.8510, 89.3711),
+    'jessore': (23.1664, 89.2081), 'cox\'s bazar': (21.4394, 92.0077), 'dinajpur': (25.6279, 88.6332),
+    'tangail': (24.2513, 89.9167), 'pabna': (24.0064, 89.2372), 'noakhali': (22.8696, 91.0995),
+    'faridpur': (23.6071, 89.8429), 'kushtia': (23.9013, 89.1204),
+}
+
+class FakeSettings:
+    """Injected behaviour, shared by all handler threads."""
+    latency = 0.05  # Base response delay in seconds
+    jitter = 0.02  # Extra random delay, up to this many seconds
+    error_rate = 0.0  # Fraction of requests answered with a 503
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # path -> count
+
+def _stable_id(text):
+    return int(hashlib.md5(text.encode()).hexdigest()[:6], 16)
+
+def _current(name, lat, lon, city_id):
+    now = int(time.time())
+    seed = random.Random(f"{city_id}:{now // 600}")
+    temp = round(seed.uniform(18, 34), 2)
+    return {
+        'coord': {'lon': lon, 'lat': lat},
+        'weather': [seed.choice([
+            {'id': 800, 'main': 'Clear', 'description': 'clear sky', 'icon': '01d'},
+            {'id': 803, 'main': 'Clouds', 'description': 'broken clouds', 'icon': '04d'},
+            {'id': 500, 'main': 'Rain', 'description': 'light rain', 'icon': '10d'},
+            {'id': 721, 'main': 'Haze', 'description': 'haze', 'icon': '50d'},
+        ])],
+        'base': 'stations',
+        'main': {'temp': temp, 'feels_like': round(temp + 2.5, 2), 'temp_min': round(temp - 1, 2),
+                 'temp_max': round(temp + 1, 2), 'pressure': 1008, 'humidity': seed.randint(45, 95),
+                 'sea_level': 1008, 'grnd_level': 1007},
+        'visibility': 4000,
+        'wind': {'speed': round(seed.uniform(0.5, 7), 2), 'deg': seed.randint(0, 359), 'gust': 5.1},
+        'clouds': {'all': seed.randint(0, 100)},
+        'dt': now,
+        'sys': {'type': 1, 'id': 9145, 'country': 'BD', 'sunrise': now - now % 86400 - 21600 + 22000,
+                'sunset': now - now % 86400 - 21600 + 64000},
+        'timezone': 21600,
+        'id': city_id,
+        'name': name,
+        'cod': 200,
+    }
+
+def _forecast(name, lat, lon, city_id):
+    start = int(time.time()) // 10800 * 10800 + 10800
+    seed = random.Random(f"{city_id}:{start}")
+    slots = []
+    for i in range(40):
+        dt = start + i * 10800
+        temp = round(seed.uniform(20, 33), 2)
+        condition = seed.choice([('Clear', '01d'), ('Clouds', '03d'), ('Rain', '10d')])
+        slot = {
+            'dt': dt,
+            'main': {'temp': temp, 'feels_like': temp + 1.5, 'temp_min': temp - 0.8, 'temp_max': temp + 0.8,
+                     'pressure': 1008, 'sea_level': 1008, 'grnd_level': 1007, 'humidity': seed.randint(50, 95),
+                     'temp_kf': 0},
+            'weather': [{'id': 800, 'main': condition[0], 'description': condition[0].lower(), 'icon': condition[1]}],
+            'clouds': {'all': seed.randint(0, 100)},
+            'wind': {'speed': round(seed.uniform(0.5, 8), 2), 'deg': seed.randint(0, 359), 'gust': 4.2},
+            'visibility': 10000,
+            'pop': round(seed.random(), 2),
+            'sys': {'pod': 'd'},
+            'dt_txt': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(dt)),
+        }
+        if condition[0] == 'Rain':
+            slot['rain'] = {'3h': round(seed.uniform(0.1, 6), 2)}
+        slots.append(slot)
+    return {
+        'cod': '200', 'message': 0, 'cnt': len(slots), 'list': slots,
+        'city': {'id': city_id, 'name': name, 'coord': {'lat': lat, 'lon': lon}, 'country': 'BD',
+                 'population': 0, 'timezone': 21600, 'sunrise': start, 'sunset': start + 42000},
+    }
+
+def _resolve(query):
+    """Returns (name, lat, lon, id) for ?q= or ?lat=&lon=, or None if unknown."""
+    if 'q' in query:
+        name = query['q'][0].split(',')[0].strip()
+        coords = KNOWN_CITIES.get(name.lower())
+        if coords is None:
+            return None
+        return name, coords[0], coords[1], _stable_id(name.lower())
+    lat, lon = float(query['lat'][0]), float(query['lon'][0])
+    nearest = min(KNOWN_CITIES, key=lambda city: (KNOWN_CITIES[city][0] - lat) ** 2 + (KNOWN_CITIES[city][1] - lon) ** 2)
+    return nearest.title(), lat, lon, _stable_id(f"{lat:.2f},{lon:.2f}")
+
+class FakeOWMHandler(BaseHTTPRequestHandler):
+    settings = FakeSettings()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        settings = self.settings
+        with settings.lock:
+            settings.requests[url.path] = settings.requests.get(url.path, 0) + 1
+
+        time.sleep(settings.latency + random.uniform(0, settings.jitter))
+        if settings.error_rate and random.random() < settings.error_rate:
+            return self._send(503, {'cod': 503, 'message': 'Injected failure'})
+        if 'appid' not in query:
+            return self._send(401, {'cod': 401, 'message': 'Invalid API key.'})
+
+        try:
+            if url.path in ('/data/2.5/weather', '/data/2.5/forecast'):
+                place = _resolve(query)
+                if place is None:
+                    return self._send(404, {'cod': '404', 'message': 'city not found'})
+                builder = _current if url.path.endswith('weather') else _forecast
+                return self._send(200, builder(*place))
+            if url.path == '/data/2.5/group':
+                by_id = {_stable_id(city): city for city in KNOWN_CITIES}
+                ids = [int(city_id) for city_id in query['id'][0].split(',') if city_id]
+                found = [_current(by_id[i].title(), *KNOWN_CITIES[by_id[i]], i) for i in ids if i in by_id]
+                return self._send(200, {'cnt': len(found), 'list': found})
+            if url.path == '/data/2.5/uvi':
+                return self._send(200, {'lat': float(query['lat'][0]), 'lon': float(query['lon'][0]),
+                                        'date_iso': time.strftime('%Y-%m-%dT12:00:00Z'), 'date': int(time.time()),
+                                        'value': round(random.uniform(0, 11), 2)})
+            if url.path == '/data/2.5/air_pollution':
+                return self._send(200, {'coord': {'lon': float(query['lon'][0]), 'lat': float(query['lat'][0])},
+                                        'list': [{'main': {'aqi': random.randint(1, 5)}, 'dt': int(time.time()),
+                                                  'components': {'co': 700.9, 'no': 0.1, 'no2': 20.2, 'o3': 30.4,
+                                                                 'so2': 9.5, 'pm2_5': round(random.uniform(5, 160), 2),
+                                                                 'pm10': 110.3, 'nh3': 6.1}}]})
+            if url.path == '/geo/1.0/direct':
+                prefix = query['q'][0].split(',')[0].strip().lower()
+                limit = int(query.get('limit', ['5'])[0])
+                matches = [city for city in sorted(KNOWN_CITIES) if city.startswith(prefix)][:limit]
+                return self._send(200, [{'name': city.title(), 'lat': KNOWN_CITIES[city][0],
+                                         'lon': KNOWN_CITIES[city][1], 'country': 'BD'} for city in matches])
+        except (KeyError, ValueError):
+            return self._send(400, {'cod': '400', 'message': 'Bad request'})
+        return self._send(404, {'cod': '404', 'message': 'Unknown endpoint'})
+
+class _FakeServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 drops connections under async load
+    request_queue_size = 1024
+
+def start_server(host='127.0.0.1', port=0, latency=None, jitter=None, error_rate=None):
+    """Starts the fake server in a daemon thread. Returns (server, base_url)."""
+    settings = FakeSettings()
+    if latency is not None:
+        settings.latency = latency
+    if jitter is not None:
+        settings.jitter = jitter
+    if error_rate is not None:
+        settings.error_rate = error_rate
+    handler = type('Handler', (FakeOWMHandler,), {'settings': settings})
+    server = _FakeServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=FakeSettings.latency, help='base delay in seconds')
+    parser.add_argument('--jitter', type=float, default=FakeSettings.jitter, help='extra random delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=FakeSettings.error_rate, help='fraction of 503 responses')
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.host, args.port, args.latency, args.jitter, args.error_rate)
+    print(f"Fake OpenWeatherMap listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
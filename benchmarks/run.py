@@ -0,0 +1,214 @@
+"""
+Load benchmark for the main endpoints, run against the fake OpenWeatherMap
+server so it costs no API quota.
+
+Measures throughput and p50/p99 latency of /, /weather, /weather-by-coords
+and /api/search-suggestions, once with a cold cache (every lookup misses) and
+once with a warm one, and writes the results as JSON:
+
+    python -m benchmarks.run --requests 300 --concurrency 8 --output benchmarks/results.json
+
+Pass --baseline with an earlier results file to compare; the run exits with
+status 1 if p99 latency or throughput regressed by more than --max-regression.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_owm import KNOWN_CITIES, start_server
+
+CITIES = [city.title() for city in KNOWN_CITIES]
+SEARCH_QUERIES = ['Dha', 'Chit', 'Khu', 'Raj', 'Syl', 'Bog', 'Jess', 'Cox', 'Narayan', 'Gaz', 'Mymen', 'Rang']
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+def _coords(i):
+    """Spreads coordinate requests over Bangladesh, about 11 km apart."""
+    return 21.5 + (i % 40) * 0.1, 88.5 + (i // 40 % 35) * 0.1
+
+# endpoint -> function building the i-th request as (path, headers)
+SCENARIOS = {
+    '/': lambda i: ('/', {}),
+    '/weather': lambda i: (f'/weather?city={CITIES[i % len(CITIES)]}', AJAX),
+    '/weather-by-coords': lambda i: ('/weather-by-coords?lat={:.2f}&lon={:.2f}'.format(*_coords(i)), AJAX),
+    '/api/search-suggestions': lambda i: (f'/api/search-suggestions?q={SEARCH_QUERIES[i % len(SEARCH_QUERIES)]}', {}),
+}
+
+# Cold runs expire every entry (and every part of it) immediately and disable
+# nearby reuse, so each request takes the full miss path
+COLD_CONFIG = {
+    'CACHE_SOFT_TTL': 0, 'CACHE_HARD_TTL': 0, 'COORD_REUSE_RADIUS_KM': 0,
+    'CURRENT_TTL': 0, 'FORECAST_TTL': 0, 'AQI_TTL': 0, 'UVI_TTL': 0, 'MOON_TTL': 0,
+}
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def _serve(app):
+    """Serves the app on a free local port in a daemon thread. Returns the base URL."""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def _run_scenario(base_url, build_request, total, concurrency):
+    """Issues `total` requests from `concurrency` clients and summarises the latencies."""
+    local = threading.local()
+
+    def one(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        path, headers = build_request(i)
+        start = time.perf_counter()
+        try:
+            response = session.get(base_url + path, headers=headers, timeout=60)
+            ok = response.status_code in (200, 304)
+        except requests.exceptions.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in samples)
+    return {
+        'requests': total,
+        'errors': sum(1 for _, ok in samples if not ok),
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    fake_server, fake_url = start_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    # weather_api reads these when it is first imported
+    os.environ['OWM_BASE_URL'] = fake_url
+    os.environ.setdefault('API_KEY', 'benchmark')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # The fake server has no quota; don't let the call governor throttle the run
+    os.environ.setdefault('OWM_CALLS_PER_MINUTE', '1000000')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    # The cache directory is relative to the working directory; keep the run's entries out of the repo
+    workdir = tempfile.mkdtemp(prefix='shamiran-bench-')
+    os.chdir(workdir)
+    from app import create_app
+
+    app = create_app('prod')
+    server, base_url = _serve(app)
+    upstream_counts = fake_server.RequestHandlerClass.settings.requests
+
+    results = []
+    for mode in ('cold', 'warm'):
+        defaults = {key: app.config.get(key) for key in COLD_CONFIG}
+        app.config.update(COLD_CONFIG if mode == 'cold' else {})
+        for endpoint, build_request in SCENARIOS.items():
+            if endpoint not in args.endpoints:
+                continue
+            if mode == 'warm':
+                # Fill the cache with every location the scenario will ask for
+                _run_scenario(base_url, build_request, args.requests, args.concurrency)
+            calls_before = sum(upstream_counts.values())
+            summary = _run_scenario(base_url, build_request, args.requests, args.concurrency)
+            summary.update({'endpoint': endpoint, 'cache': mode,
+                            'upstream_calls': sum(upstream_counts.values()) - calls_before})
+            results.append(summary)
+            print(f"{mode:5} {endpoint:26} {summary['throughput_rps']:8.1f} req/s  "
+                  f"p50 {summary['p50_ms']:8.2f} ms  p99 {summary['p99_ms']:8.2f} ms  "
+                  f"errors {summary['errors']}  upstream {summary['upstream_calls']}")
+        app.config.update(defaults)
+
+    server.shutdown()
+    fake_server.shutdown()
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'upstream_latency_s': args.latency,
+            'upstream_jitter_s': args.jitter,
+            'upstream_error_rate': args.error_rate,
+        },
+        'results': results,
+    }
+
+def compare(report, baseline, max_regression):
+    """Prints changes against a baseline report. Returns True if anything regressed too far."""
+    previous = {(result['endpoint'], result['cache']): result for result in baseline.get('results', [])}
+    regressed = False
+    for result in report['results']:
+        before = previous.get((result['endpoint'], result['cache']))
+        if not before:
+            continue
+        p99_change = result['p99_ms'] / before['p99_ms'] - 1 if before['p99_ms'] else 0
+        throughput_change = result['throughput_rps'] / before['throughput_rps'] - 1 if before['throughput_rps'] else 0
+        flag = ''
+        if p99_change > max_regression or throughput_change < -max_regression:
+            flag = '  REGRESSION'
+            regressed = True
+        print(f"{result['cache']:5} {result['endpoint']:26} p99 {p99_change:+7.1%}  "
+              f"throughput {throughput_change:+7.1%}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream base latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='fake upstream random extra latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of fake upstream calls that fail')
+    parser.add_argument('--endpoints', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--output', default=os.path.join(REPO_ROOT, 'benchmarks', 'results.json'))
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed fractional p99/throughput regression against the baseline')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    report = run(args)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if baseline is not None and compare(report, baseline, args.max_regression):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()